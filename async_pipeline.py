@@ -0,0 +1,250 @@
+'''
+Asyncio execution mode for the playlist pipeline (CAPSULE_EXECUTION=async, run through jobs.submit_async).
+
+Same steps and same result as logic.main(), written as a coroutine. Every blocking client call (Spotify, Google
+Calendar, Firestore, OpenAI) runs on the jobs loop's I/O threads behind a per-upstream semaphore, so one slow
+upstream can't take every thread, and the calendar cache sync runs alongside the library sync (over the span the
+cache already covers). The description is awaited before the playlist is written, so the Spotify write stays a
+single create-with-description plus the track adds.
+
+A job only takes a thread for the call itself: queueing for an upstream's semaphore or for its rate limiter token
+(rate_limit.py) happens on the loop. Once running, a call keeps its thread for as long as it takes, including any
+429 backoff inside it and any further requests a multi-request stage (a library sync, a description) makes, so
+the semaphores are what bound how many threads one slow or throttled upstream can pin. Jobs beyond that wait on
+the loop without a thread, so the number of jobs a process can carry isn't tied to the size of its thread pool.
+
+Cancelling a job (the user clicked "Make Another" again) stops it at its next await. Calls already running on a
+thread can't be interrupted, so they're waited for before the cancellation goes through (nothing is left running
+against the session's clients), and once the playlist is being written to Spotify the job finishes regardless.
+'''
+
+import asyncio
+import os
+import time
+
+import jobs
+import logic
+import metrics
+import rate_limit
+import token_store
+from candidates import invalidate as invalidate_candidates, pool_size as candidate_pool_size, pop_candidate, start_precompute
+from clients import in_use
+from event_cache import cached_span, event_starts, fetch_windows, sync_events
+from nlp import process
+from song_index import get_song_index, window_at
+from spotify_writer import write_playlist
+from sync import sync_library
+from window_scoring import sample_windows, score_windows
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# BLOCKING CALLS ALLOWED IN FLIGHT PER UPSTREAM, ACROSS ALL ASYNC JOBS
+UPSTREAM_LIMITS = {
+    'spotify': int(os.getenv('CAPSULE_SPOTIFY_CONCURRENCY', '16')),
+    'calendar': int(os.getenv('CAPSULE_CALENDAR_CONCURRENCY', '8')),
+    'firestore': int(os.getenv('CAPSULE_FIRESTORE_CONCURRENCY', '32')),
+    'openai': int(os.getenv('CAPSULE_OPENAI_CONCURRENCY', '8'))
+}
+
+semaphores = {}  # (event loop, upstream) -> asyncio.Semaphore
+
+
+def semaphore(upstream):
+    key = (asyncio.get_running_loop(), upstream)
+    if key not in semaphores:
+        semaphores[key] = asyncio.Semaphore(UPSTREAM_LIMITS[upstream])
+    return semaphores[key]
+
+
+async def call(upstream, fn, *args, **kwargs):
+
+    '''
+    Runs a blocking call on an I/O thread, holding one of the upstream's slots while it runs.
+    For rate limited upstreams, the call's first token is waited for here on the loop and handed to the thread.
+
+    upstream (string): spotify, calendar, firestore or openai
+    '''
+
+    async with semaphore(upstream):
+        paid = {}
+        if upstream in rate_limit.buckets:
+            await rate_limit.buckets[upstream].acquire_async()
+            paid[upstream] = 1
+        token = rate_limit.prepaid.set(paid)
+        try:
+            inner = asyncio.ensure_future(asyncio.to_thread(fn, *args, **kwargs))  # copies the context, paid included
+        finally:
+            rate_limit.prepaid.reset(token)
+        try:
+            return await asyncio.shield(inner)
+        except asyncio.CancelledError:
+            # The thread can't be stopped; let it finish before the job lets go of its clients
+            await asyncio.wait({inner})
+            raise
+
+
+async def in_span(stage, awaitable):
+    with metrics.span(stage):
+        return await awaitable
+
+
+async def sync_calendar(service, username, calendar_timezone, span_start):
+
+    '''
+    Brings the user's event cache up to date from span_start until tomorrow. Returns span_start.
+    '''
+
+    span_end = int(time.time()) + SECONDS_PER_DAY
+    with metrics.span('calendar'):
+        mode, received = await call('calendar', sync_events, service, username, calendar_timezone, span_start, span_end)
+    print(f"Event cache sync ({mode}): {received} events received")
+    return span_start
+
+
+def pick_candidates(song_index, starts, playlist_length, candidate_count):
+    weights, _ = score_windows(song_index['epochs'], starts, playlist_length)
+    return [window_at(song_index, first, playlist_length)
+            for first in sample_windows(weights, candidate_count, playlist_length)]
+
+
+async def finish(awaitable):
+
+    '''
+    Runs the last step of a job to completion even if the job is cancelled meanwhile (a playlist half written to
+    the user's account is worse than one the user didn't wait for).
+    '''
+
+    final = asyncio.ensure_future(awaitable)
+    try:
+        return await asyncio.shield(final)
+    except asyncio.CancelledError:
+        return await final
+
+
+async def main(session_id='standalone', store=token_store):
+
+    '''
+    logic.main() as a coroutine, for jobs.submit_async.
+
+    session_id (string): session uuid; keys both the token store and the per-session client cache in clients.py
+    store (module): where this session's tokens live (token_store)
+    Returns a dict describing the playlist that was written.
+    '''
+
+    print('RUNNING ASYNC PIPELINE')
+
+    pending = []  # helper tasks, stopped and drained however the job ends
+    with in_use(session_id):  # the session's cached clients stay open until this job is done with them
+        try:
+            return await run(session_id, store, pending)
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+
+async def run(session_id, store, pending):
+
+    # SPOTIFY, GCAL, FIREBASE + OPENAI SETUP
+    session = await call('spotify', logic.setup, session_id, store)
+    sp, profile, username = session['sp'], session['profile'], session['username']
+    service, db, google_calendar_timezone = session['service'], session['db'], session['calendar_timezone']
+    to_songs = logic.make_to_songs(google_calendar_timezone)
+
+    #1. SYNC LIBRARY; MEANWHILE BRING THE EVENT CACHE UP TO DATE OVER THE SPAN IT ALREADY COVERS
+    jobs.progress('import')
+    prefetch = None
+    span = await asyncio.to_thread(cached_span, username)
+    if span is not None:
+        prefetch = asyncio.ensure_future(sync_calendar(service, username, google_calendar_timezone, span[0]))
+        pending.append(prefetch)
+
+    with metrics.span('library_sync'):
+        summary = await call('spotify', sync_library, db, sp, username, to_songs)
+    if summary['added'] or summary['removed']:
+        invalidate_candidates(username)
+    jobs.progress('selection', **summary)
+
+    playlist_title = logic.PLAYLIST_TITLE
+
+    #2. PRECOMPUTED CANDIDATE READY? THEN THE SPOTIFY WRITE IS ALL THAT'S LEFT
+    candidate = pop_candidate(username)
+    if candidate:
+        print(f"Using precomputed candidate ({candidate['score']} events)")
+        print(f"FINAL DESCRIPTION: {candidate['description']}")
+        jobs.progress('spotify_write', precomputed=True)
+        playlist_id, _ = await finish(in_span('spotify_write', call(
+            'spotify', write_playlist, sp, profile['id'], candidate['tracks'], playlist_title, candidate['description'])))
+
+        # TOP UP THE POOL IN THE BACKGROUND BEFORE IT RUNS DRY (ONCE THE EVENT CACHE IS SYNCED)
+        if candidate_pool_size(username) < 2:
+            if prefetch is not None:
+                await asyncio.wait({prefetch})
+            song_index = await call('firestore', get_song_index, db, username, summary['version'])
+            start_precompute(song_index, username)
+
+        return {'playlist_id': playlist_id, 'description': candidate['description']}
+
+    # PURE LOGIC
+    playlistLength = logic.PLAYLIST_LENGTH
+
+    #3. SORTED DATE INDEX OF THE USER'S SONGS
+    with metrics.span('song_index'):
+        song_index = await call('firestore', get_song_index, db, username, summary['version'])
+
+    #4. EVENT CACHE: TAKE THE PREFETCHED SYNC, UNLESS THE LIBRARY NOW REACHES FURTHER BACK THAN IT COVERED
+    jobs.progress('calendar')
+    event_cache_ready = False
+    starts = []
+    try:
+        synced_from = await prefetch if prefetch is not None else None
+        if synced_from is None or song_index['epochs'][0] < synced_from:
+            await sync_calendar(service, username, google_calendar_timezone, song_index['epochs'][0])
+        starts = await asyncio.to_thread(event_starts, username)
+        event_cache_ready = True
+    except Exception as e:
+        print(f"Event cache unavailable, falling back to batched Calendar lookups: {e}")
+
+    #5. SCORE EVERY WINDOW IN ONE PASS AND DRAW CANDIDATES (OFF THE LOOP, IT'S A FEW MS OF NUMPY FOR BIG LIBRARIES)
+    with metrics.span('window_scoring'):
+        candidates = await asyncio.to_thread(pick_candidates, song_index, starts, playlistLength, logic.CANDIDATE_COUNT)
+
+    #6. EVENTS FOR EVERY CANDIDATE, FROM THE LOCAL EVENT CACHE (OR ONE BATCHED CALENDAR REQUEST WITHOUT IT)
+    windows = [(playlistStart, playlistEnd) for _, playlistStart, playlistEnd, _ in candidates]
+    with metrics.span('calendar'):
+        if event_cache_ready:
+            window_events = await asyncio.to_thread(fetch_windows, username, windows)
+        else:
+            window_events = await call('calendar', logic.gcal_event_fetch_batch, service, windows)
+
+    with_events = [(candidate, events) for candidate, events in zip(candidates, window_events) if events]
+    print(f"{len(with_events)} of {len(candidates)} candidate windows have calendar events")
+
+    #7. DESCRIPTION, THEN ONE CREATE-WITH-DESCRIPTION WRITE (SEE spotify_writer.py)
+    if with_events:
+        (next_songs, playlistStart, playlistEnd, tracks), events = with_events[0]
+        event_descriptions = ', '.join([event[1] for event in events])
+        print(f"raw event descriptions: {event_descriptions}")
+
+        jobs.progress('nlp', events=len(events))
+        with metrics.span('nlp'):
+            playlist_description = await call('openai', process, event_descriptions)
+    else:
+        next_songs, playlistStart, playlistEnd, tracks = candidates[0] if candidates else ([], None, None, [])
+        playlist_description = logic.NO_EVENTS_DESCRIPTION
+
+    print(f"FINAL DESCRIPTION: {playlist_description}")
+    jobs.progress('spotify_write', precomputed=False)
+    playlist_id, _ = await finish(in_span('spotify_write', call(
+        'spotify', write_playlist, sp, profile['id'], tracks, playlist_title, playlist_description)))
+
+    #8. PRECOMPUTE THE NEXT FEW CAPSULES IN THE BACKGROUND
+    if event_cache_ready:
+        start_precompute(song_index, username)
+
+    return {'playlist_id': playlist_id, 'description': playlist_description}
+
+
+if __name__ == '__main__':
+    print(asyncio.run(main()))
@@ -0,0 +1,101 @@
+'''
+Compares the old one-add()-per-song import path with ingest.write_songs_batched against a local
+Firestore emulator. Nothing here touches the real capsulev3 project.
+
+Start the emulator first, then point this script at it:
+
+    gcloud emulators firestore start --host-port=localhost:8080
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python benchmarks/ingest_emulator.py --songs 1000
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from google.cloud import firestore
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from ingest import write_songs_batched
+
+BASE62 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+
+def synthetic_songs(count, seed=0):
+
+    '''
+    Builds count fake song_data dicts shaped like the ones logic.py writes.
+    '''
+
+    rng = random.Random(seed)
+    added = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    songs = []
+    for _ in range(count):
+        added -= timedelta(minutes=rng.randint(5, 60 * 24 * 3))
+        songs.append({
+            'addedDate': added.isoformat(),
+            'addedEpoch': int(added.timestamp()),
+            'trackURI': 'spotify:track:' + ''.join(rng.choice(BASE62) for _ in range(22))
+        })
+    return songs
+
+
+def clear_collection(db, collection_name):
+    docs = list(db.collection(collection_name).list_documents())
+    for start in range(0, len(docs), 500):
+        batch = db.batch()
+        for doc in docs[start:start + 500]:
+            batch.delete(doc)
+        batch.commit()
+
+
+def per_document(db, collection_name, songs):
+
+    '''
+    The original import path: one collection_ref.add() round trip per song.
+    '''
+
+    started = time.perf_counter()
+    collection_ref = db.collection(collection_name)
+    for song_data in songs:
+        collection_ref.add(song_data)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--songs', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    if not os.getenv('FIRESTORE_EMULATOR_HOST'):
+        sys.exit("FIRESTORE_EMULATOR_HOST is not set, refusing to run against a real project.")
+
+    db = firestore.Client(project='capsule-bench')
+    songs = synthetic_songs(args.songs)
+
+    print(f"{'run':>4} {'per-document (s)':>18} {'batched (s)':>12} {'commits':>8} {'songs/s':>10} {'speedup':>8}")
+    for run in range(1, args.runs + 1):
+        clear_collection(db, 'bench_per_document')
+        clear_collection(db, 'bench_batched')
+
+        per_document_seconds = per_document(db, 'bench_per_document', songs)
+        stats = write_songs_batched(db, 'bench_batched', songs)
+
+        speedup = per_document_seconds / stats['elapsed'] if stats['elapsed'] > 0 else float('inf')
+        print(f"{run:>4} {per_document_seconds:>18.3f} {stats['elapsed']:>12.3f} {stats['commits']:>8} "
+              f"{stats['songs_per_sec']:>10.0f} {speedup:>7.1f}x")
+
+    # Re-running the batched import must not duplicate anything
+    write_songs_batched(db, 'bench_batched', songs)
+    stored = len(list(db.collection('bench_batched').list_documents()))
+    print(f"idempotency: {stored} documents after re-import of {len(songs)} songs")
+
+    clear_collection(db, 'bench_per_document')
+    clear_collection(db, 'bench_batched')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,457 @@
+'''
+Runs logic.main() end to end without any live accounts: Spotify, Google Calendar, Firestore and OpenAI are
+replaced by in-memory stand-ins that inject a fixed latency per call and serve a synthetic library and calendar.
+
+For every library size it does one cold run (first import, full calendar sync) followed by --runs warm runs
+(incremental sync, event cache hits), and reports end-to-end time, per-stage time (from metrics.span), external
+call counts (from metrics.external) and peak Python memory (tracemalloc).
+
+    python benchmarks/pipeline_offline.py --tracks 1000 10000 100000 --events-per-week 6
+    python benchmarks/pipeline_offline.py --tracks 10000 --precompute --json results.json
+    python benchmarks/pipeline_offline.py --tracks 10000 --execution async
+
+With --precompute, the background candidate pool is filled inline after each run (timed on its own, outside the
+end-to-end number), so warm runs measure the "Make Another" path. With --execution async, each run goes through
+async_pipeline.main() (the CAPSULE_EXECUTION=async path) instead. The real client libraries still need to be
+installed, since logic.py imports them; nothing here makes a network call.
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+os.environ.setdefault('OPENAI_API_KEY', 'offline-benchmark')  # nlp.py refuses to import without one
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import async_pipeline
+import candidates
+import description_cache
+import event_cache
+import logic
+import metrics
+import nlp
+import snapshot
+import song_index
+
+BASE62 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+CALENDAR_TIMEZONE = 'America/New_York'
+EVENT_TITLES = ['Dentist', 'Team standup', 'Birthday dinner', 'Flight to Lisbon', 'Concert', 'Study group',
+                'Moving day', 'Wedding', 'Job interview', 'Beach trip', 'Finals week', 'Housewarming']
+
+
+def pause(seconds):
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+def iso(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def parse_iso(value):
+    return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp())
+
+
+# SYNTHETIC DATA
+def synthetic_library(count, span_days, seed=0):
+
+    '''
+    count liked songs spread over the last span_days, newest first (the order Spotify returns them in).
+    Gaps are bursty: mostly minutes to hours apart, with the occasional weeks-long quiet spell.
+    '''
+
+    rng = random.Random(seed)
+    gaps = [rng.expovariate(1.0) * (40 if rng.random() < 0.02 else 1) for _ in range(count)]
+    scale = span_days * 86400 / sum(gaps)
+
+    added = time.time()
+    items = []
+    for gap in gaps:
+        added -= gap * scale
+        items.append({
+            'added_at': iso(int(added)),
+            'track': {'uri': 'spotify:track:' + ''.join(rng.choice(BASE62) for _ in range(22))}
+        })
+    return items
+
+
+def synthetic_calendar(span_days, events_per_week, seed=0):
+
+    '''
+    Timed events over the last span_days (plus a week ahead), events_per_week on average, sorted by start.
+    '''
+
+    rng = random.Random(seed)
+    now = int(time.time())
+    start = now - span_days * 86400
+    count = int(span_days / 7 * events_per_week)
+
+    events = []
+    for i in range(count):
+        event_start = rng.randint(start, now + 7 * 86400)
+        events.append({
+            'id': f'event{i}',
+            'status': 'confirmed',
+            'summary': rng.choice(EVENT_TITLES),
+            'start': {'dateTime': iso(event_start)},
+            'end': {'dateTime': iso(event_start + rng.choice([1800, 3600, 7200, 86400]))}
+        })
+    events.sort(key=lambda event: event['start']['dateTime'])
+    return events
+
+
+# SPOTIFY STAND-IN
+class FakeSpotify:
+
+    def __init__(self, library, latency):
+        self.library = library
+        self.latency = latency
+
+    def current_user(self):
+        pause(self.latency)
+        return {'id': 'bench-user', 'display_name': 'bench-user'}
+
+    def current_user_saved_tracks(self, limit=20, offset=0):
+        pause(self.latency)
+        return {'items': self.library[offset:offset + limit], 'total': len(self.library)}
+
+    def user_playlist_create(self, user, name, public=True, description=''):
+        pause(self.latency)
+        return {'id': 'bench-playlist'}
+
+    def playlist_add_items(self, playlist_id, items):
+        pause(self.latency)
+        return {'snapshot_id': 'bench'}
+
+
+# GOOGLE CALENDAR STAND-IN
+class FakeRequest:
+
+    def __init__(self, calendar, params):
+        self.calendar = calendar
+        self.params = params
+
+    def execute(self):
+        pause(self.calendar.latency)
+        return self.calendar.list_events(self.params)
+
+
+class FakeBatch:
+
+    def __init__(self, calendar, callback):
+        self.calendar = calendar
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        pause(self.calendar.latency)
+        for request_id, request in self.requests:
+            self.callback(request_id, self.calendar.list_events(request.params), None)
+
+
+class FakeCalendar:
+
+    def __init__(self, calendar_events, latency):
+        self.calendar_events = calendar_events
+        self.latency = latency
+
+    def events(self):
+        return SimpleNamespace(list=lambda **params: FakeRequest(self, params))
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def list_events(self, params):
+        # Nothing changes between runs, so every incremental sync is an empty delta
+        if params.get('syncToken'):
+            return {'items': [], 'nextSyncToken': 'bench-sync'}
+
+        time_min = parse_iso(params['timeMin']) if params.get('timeMin') else float('-inf')
+        time_max = parse_iso(params['timeMax']) if params.get('timeMax') else float('inf')
+        matching = [event for event in self.calendar_events
+                    if parse_iso(event['start']['dateTime']) < time_max and parse_iso(event['end']['dateTime']) > time_min]
+
+        page_size = params.get('maxResults', 250)
+        offset = int(params.get('pageToken') or 0)
+        page = {'items': matching[offset:offset + page_size]}
+        if offset + page_size < len(matching):
+            page['nextPageToken'] = str(offset + page_size)
+        else:
+            page['nextSyncToken'] = 'bench-sync'
+        return page
+
+
+# FIRESTORE STAND-IN (just the calls sync.py, ingest.py and song_index.py make)
+class FakeSnapshot:
+
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data) if self.data is not None else None
+
+
+class FakeDocument:
+
+    def __init__(self, db, collection_name, doc_id):
+        self.db = db
+        self.collection_name = collection_name
+        self.id = doc_id
+
+    def get(self):
+        pause(self.db.latency)
+        with self.db.lock:
+            return FakeSnapshot(self.id, self.db.collections.get(self.collection_name, {}).get(self.id))
+
+    def set(self, data):
+        pause(self.db.latency)
+        with self.db.lock:
+            self.db.collections.setdefault(self.collection_name, {})[self.id] = dict(data)
+
+
+class FakeQuery:
+
+    def __init__(self, db, collection_name, limit=None):
+        self.db = db
+        self.collection_name = collection_name
+        self.limit_count = limit
+
+    def select(self, fields):
+        return self
+
+    def limit(self, count):
+        return FakeQuery(self.db, self.collection_name, count)
+
+    def stream(self):
+        pause(self.db.latency)
+        with self.db.lock:
+            docs = list(self.db.collections.get(self.collection_name, {}).items())
+        for doc_id, data in docs[:self.limit_count]:
+            yield FakeSnapshot(doc_id, data)
+
+    def get(self):
+        return list(self.stream())
+
+
+class FakeCollection(FakeQuery):
+
+    def document(self, doc_id):
+        return FakeDocument(self.db, self.collection_name, doc_id)
+
+    def list_documents(self):
+        pause(self.db.latency)
+        with self.db.lock:
+            doc_ids = list(self.db.collections.get(self.collection_name, {}))
+        return [self.document(doc_id) for doc_id in doc_ids]
+
+
+class FakeWriteBatch:
+
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, doc_ref, data):
+        self.writes.append((doc_ref, data))
+
+    def delete(self, doc_ref):
+        self.writes.append((doc_ref, None))
+
+    def commit(self):
+        pause(self.db.latency)
+        with self.db.lock:
+            for doc_ref, data in self.writes:
+                collection = self.db.collections.setdefault(doc_ref.collection_name, {})
+                if data is None:
+                    collection.pop(doc_ref.id, None)
+                else:
+                    collection[doc_ref.id] = dict(data)
+
+
+class FakeFirestore:
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.collections = {}
+        self.lock = threading.Lock()
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+
+# OPENAI STAND-IN
+class FakeCompletions:
+
+    def __init__(self, latency, accept_rate, seed=0):
+        self.latency = latency
+        self.accept_rate = accept_rate
+        self.rng = random.Random(seed)
+
+    def create(self, model=None, prompt='', max_tokens=None, n=1, timeout=None):
+        pause(self.latency)
+        choices = []
+        for _ in range(n):
+            if self.rng.random() < self.accept_rate:
+                text = f"A season of {self.rng.choice(EVENT_TITLES).lower()} and long evenings, remembered fondly."
+            else:
+                text = "the newspaper was mostly about the weather"  # fails prepare()
+            choices.append(SimpleNamespace(text=text))
+        return SimpleNamespace(choices=choices)
+
+
+class FakeTokenStore:
+
+    def get(self, session_id):
+        return {
+            'spotify_token_info': {'access_token': 'offline', 'expires_at': time.time() + 3600},
+            'google_credentials': {'token': 'offline'},
+            'calendar_timezone': CALENDAR_TIMEZONE
+        }
+
+
+# MEASUREMENT
+def collect_metrics():
+
+    '''
+    Per-stage seconds and external call counts recorded during the run.
+    '''
+
+    with metrics.lock:
+        stages = {dict(labels)['stage']: round(histogram['sum'], 4)
+                  for (name, labels), histogram in metrics.histograms.items() if name == 'capsule_stage_seconds'}
+        calls = {}
+        for (name, labels), value in metrics.counters.items():
+            if name == 'capsule_external_calls_total':
+                labels = dict(labels)
+                key = f"{labels['upstream']}.{labels['call']}"
+                calls[key] = calls.get(key, 0) + value
+    return stages, calls
+
+
+def measure(fn):
+    metrics.reset()
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    stages, calls = collect_metrics()
+    return result, {'seconds': round(elapsed, 4), 'stages': stages, 'calls': calls, 'peak_mb': round(peak / 2 ** 20, 2)}
+
+
+def run_library(args, track_count, cache_dir):
+    username = 'bench-user'
+    library = synthetic_library(track_count, args.span_days, seed=track_count)
+    calendar = synthetic_calendar(args.span_days, args.events_per_week, seed=track_count)
+
+    sp = FakeSpotify(library, args.spotify_ms / 1000)
+    service = FakeCalendar(calendar, args.calendar_ms / 1000)
+    db = FakeFirestore(args.firestore_ms / 1000)
+    nlp.openai = SimpleNamespace(completions=FakeCompletions(args.openai_ms / 1000, args.accept_rate))
+
+    # Fresh state for this library size: own event cache and snapshot directories, no cached index/pool/descriptions
+    event_cache.CACHE_DIR = os.path.join(cache_dir, str(track_count), 'events')
+    snapshot.SNAPSHOT_DIR = os.path.join(cache_dir, str(track_count), 'snapshots')
+    song_index.invalidate_song_index(username)
+    candidates.invalidate(username)
+    with description_cache.entries_lock:
+        description_cache.entries.clear()
+
+    logic.get_spotify = lambda session_id, token_info: sp
+    logic.get_calendar = lambda session_id, google_credentials: service
+    logic.get_db = lambda: db
+
+    # Precompute requests are held until the run's own measurement is over, then run inline and timed on their own
+    precompute_requests = []
+    if args.precompute:
+        start_precompute = lambda index, user: precompute_requests.append((index, user))
+    else:
+        start_precompute = lambda index, user: None
+    logic.start_precompute = async_pipeline.start_precompute = start_precompute
+
+    if args.execution == 'async':
+        pipeline = lambda: asyncio.run(async_pipeline.main('offline-bench', store=FakeTokenStore()))
+    else:
+        pipeline = lambda: logic.main('offline-bench', store=FakeTokenStore())
+
+    runs = []
+    for run in range(args.runs + 1):
+        _, result = measure(pipeline)
+        result['run'] = 'cold' if run == 0 else f'warm{run}'
+        result['tracks'] = track_count
+        if precompute_requests:
+            index, user = precompute_requests.pop()
+            del precompute_requests[:]
+            _, result['precompute'] = measure(lambda: candidates.precompute(index, user))
+        runs.append(result)
+    return runs
+
+
+def print_runs(runs):
+    stage_names = sorted({stage for result in runs for stage in result['stages']})
+    upstreams = sorted({call.split('.')[0] for result in runs for call in result['calls']})
+
+    header = f"{'tracks':>7} {'run':>6} {'total s':>8} " + ' '.join(f'{name[:14]:>14}' for name in stage_names)
+    header += ' ' + ' '.join(f'{upstream + " calls":>15}' for upstream in upstreams) + f" {'peak MB':>8}"
+    print(header)
+    for result in runs:
+        line = f"{result['tracks']:>7} {result['run']:>6} {result['seconds']:>8.3f} "
+        line += ' '.join(f"{result['stages'].get(name, 0.0):>14.3f}" for name in stage_names)
+        line += ' ' + ' '.join(f"{sum(count for call, count in result['calls'].items() if call.split('.')[0] == upstream):>15}"
+                               for upstream in upstreams)
+        line += f" {result['peak_mb']:>8.2f}"
+        if 'precompute' in result:
+            line += f"  (precompute {result['precompute']['seconds']:.3f}s)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--runs', type=int, default=3, help='warm runs after the cold one')
+    parser.add_argument('--span-days', type=int, default=8 * 365, help='how far back the library goes')
+    parser.add_argument('--events-per-week', type=float, default=5.0)
+    parser.add_argument('--spotify-ms', type=float, default=80.0)
+    parser.add_argument('--calendar-ms', type=float, default=120.0)
+    parser.add_argument('--firestore-ms', type=float, default=30.0)
+    parser.add_argument('--openai-ms', type=float, default=700.0)
+    parser.add_argument('--accept-rate', type=float, default=0.5, help='share of OpenAI completions that pass prepare()')
+    parser.add_argument('--precompute', action='store_true', help='fill the candidate pool inline after each run')
+    parser.add_argument('--execution', choices=['threads', 'async'], default='threads',
+                        help='run logic.main() or async_pipeline.main()')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='capsule-bench-') as cache_dir:
+        for track_count in args.tracks:
+            results.extend(run_library(args, track_count, cache_dir))
+
+    print_runs(results)
+    if args.json:
+        with open(args.json, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
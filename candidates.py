@@ -0,0 +1,130 @@
+'''
+Background precompute of "capsule candidates": ready-to-write playlists for a user.
+
+After a library import or sync, a background job scores every window of consecutive songs on the user's whole
+addedDate timeline (window_scoring.py: span, calendar event density, recency), samples a small pool of good,
+non-overlapping windows, and keeps them together with their events and a pre-generated description. When the
+user clicks "Make Another", logic.py pops a candidate and only has to write the playlist to Spotify.
+
+Precompute runs on its own small executor rather than the jobs.py pool, so it never takes a worker or a pending
+slot from a user's click and never shows up as a job. When that executor is backed up, new requests are skipped.
+'''
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from event_cache import event_starts, fetch_windows
+from nlp import process
+from window_scoring import sample_windows, score_windows
+
+POOL_SIZE = 5
+PLAYLIST_LENGTH = 20
+
+# BACKGROUND EXECUTOR SIZING (separate from the user-facing job pool)
+PRECOMPUTE_WORKERS = int(os.getenv('CAPSULE_PRECOMPUTE_WORKERS', '1'))
+PRECOMPUTE_PENDING = int(os.getenv('CAPSULE_PRECOMPUTE_PENDING', '8'))  # queued + running
+
+executor = ThreadPoolExecutor(max_workers=PRECOMPUTE_WORKERS, thread_name_prefix='capsule-precompute')
+precompute_slots = threading.BoundedSemaphore(PRECOMPUTE_PENDING)
+
+pools = {}  # username -> [candidate, ...], best first
+pools_lock = threading.Lock()
+in_progress = set()  # usernames with a precompute running
+generations = {}  # username -> bumped by invalidate(), so a precompute built on an outdated library is dropped
+
+
+def generation(username):
+    with pools_lock:
+        return generations.get(username, 0)
+
+
+def precompute(song_index, username, playlist_length=PLAYLIST_LENGTH, pool_size=POOL_SIZE, pool_generation=None):
+
+    '''
+    Fills the user's candidate pool. Expects the user's event cache to be synced already (logic.py does that).
+
+    pool_generation (int): the user's generation when song_index was read (start_precompute passes it); if the
+                           library was invalidated since, the pool is thrown away instead of replacing the new one
+    '''
+
+    started = time.time()
+    if pool_generation is None:
+        pool_generation = generation(username)
+    try:
+        weights, events_per_window = score_windows(song_index['epochs'], event_starts(username), playlist_length)
+        picked = sorted(((int(events_per_window[first]), first, first + playlist_length)
+                         for first in sample_windows(weights, pool_size, playlist_length)), reverse=True)
+
+        windows = [(song_index['epochs'][first], song_index['epochs'][last - 1]) for _, first, last in picked]
+        pool = []
+        for (score, first, last), events in zip(picked, fetch_windows(username, windows)):
+            if not events:
+                continue
+            pool.append({
+                'score': score,
+                'tracks': song_index['uris'][first:last],
+                'playlistStart': song_index['epochs'][first],
+                'playlistEnd': song_index['epochs'][last - 1],
+                'events': events,
+                'description': process(', '.join([event[1] for event in events]))
+            })
+
+        with pools_lock:
+            if generations.get(username, 0) != pool_generation:
+                print(f"Dropping precomputed candidates for '{username}': library changed meanwhile")
+                return 0
+            pools[username] = pool
+        print(f"Precomputed {len(pool)} candidates for '{username}' in {time.time() - started:.2f}s")
+        return len(pool)
+    finally:
+        with pools_lock:
+            in_progress.discard(username)
+
+
+def run_precompute(song_index, username, pool_generation):
+    try:
+        precompute(song_index, username, pool_generation=pool_generation)
+    except Exception as e:
+        print(f"Precompute for '{username}' failed: {e}")
+    finally:
+        precompute_slots.release()
+
+
+def start_precompute(song_index, username):
+
+    '''
+    Queues precompute() on the background executor unless one is already queued or running for this user, or
+    PRECOMPUTE_PENDING are already waiting. Returns True if it was queued.
+    '''
+
+    if not precompute_slots.acquire(blocking=False):
+        return False
+
+    with pools_lock:
+        if username in in_progress:
+            precompute_slots.release()
+            return False
+        in_progress.add(username)
+        pool_generation = generations.get(username, 0)
+
+    executor.submit(run_precompute, song_index, username, pool_generation)
+    return True
+
+
+def pop_candidate(username):
+    with pools_lock:
+        pool = pools.get(username)
+        return pool.pop(0) if pool else None
+
+
+def pool_size(username):
+    with pools_lock:
+        return len(pools.get(username, []))
+
+
+def invalidate(username):
+    with pools_lock:
+        pools.pop(username, None)
+        generations[username] = generations.get(username, 0) + 1
@@ -0,0 +1,234 @@
+'''
+Per-session cache of Spotify and Google Calendar API clients.
+
+Every job used to build its clients from scratch: a fresh requests session for spotipy, and for the Calendar API
+a discovery document fetched/parsed by build() plus a new HTTP connection. Here each session (keyed by the
+session uuid from main.py) keeps one keep-alive requests session for Spotify and one Calendar service built from
+the discovery document that ships with google-api-python-client, read from disk and parsed once per process.
+Tokens are refreshed in place when they're about to expire, and entries idle for longer than IDLE_TTL (or beyond
+MAX_SESSIONS, least recently used first) are evicted, except ones a running job holds through in_use().
+
+entries_lock only guards the table itself. Token refreshes are HTTP calls, so they happen under the entry's own
+lock, and one slow OAuth refresh holds up only its own session.
+'''
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+
+import requests
+import spotipy
+from spotipy.oauth2 import SpotifyOAuth
+from google.oauth2.credentials import Credentials
+from google.auth.transport.requests import Request
+from googleapiclient.discovery import build_from_document
+from googleapiclient import discovery_cache
+
+SPOTIFY_SCOPES = 'user-library-read playlist-modify-public'
+IDLE_TTL = 30 * 60
+MAX_SESSIONS = 256
+EXPIRY_MARGIN = 60  # refresh tokens this many seconds before they actually expire
+
+entries = OrderedDict()  # session_id -> cached clients + tokens
+entries_lock = threading.Lock()
+
+
+def refresh_spotify_token_info(token_info):
+
+    '''
+    Trades the refresh token for a new Spotify token_info dict (shared with main.py's refresh_spotify_token).
+    '''
+
+    sp_oauth = SpotifyOAuth(
+        client_id=os.getenv("SPOTIFY_CLIENT_ID"),
+        client_secret=os.getenv("SPOTIFY_CLIENT_SECRET"),
+        redirect_uri=os.getenv("SPOTIFY_REDIRECT_URI"),  # Use the same redirect URI as in create_spotify_oauth
+        scope=SPOTIFY_SCOPES)
+    return sp_oauth.refresh_access_token(token_info['refresh_token'])
+
+
+def refresh_google_credentials(creds):
+
+    '''
+    Refreshes Google Credentials in place if they've expired (shared with main.py's refresh_google_token).
+    Returns True if a refresh happened.
+    '''
+
+    if creds.expired and creds.refresh_token:
+        creds.refresh(Request())
+        return True
+    return False
+
+
+def spotify_token_expiring(token_info):
+    return 'expires_at' in token_info and token_info['expires_at'] - time.time() < EXPIRY_MARGIN
+
+
+@lru_cache(maxsize=None)
+def calendar_discovery_document():
+
+    '''
+    The Calendar v3 discovery document, read from disk once per process.
+    CALENDAR_DISCOVERY_FILE can point at a pinned copy; otherwise the one bundled with google-api-python-client is used.
+    '''
+
+    path = os.getenv('CALENDAR_DISCOVERY_FILE')
+    if path:
+        with open(path, 'r') as infile:
+            return json.load(infile)
+    return json.loads(discovery_cache.get_static_doc('calendar', 'v3'))
+
+
+def close_entry(entry):
+
+    '''
+    Closes a dropped entry's HTTP session, or leaves that to the last in_use() holder if a job is still using it.
+    Callers hold entries_lock.
+    '''
+
+    if entry['users']:
+        entry['retired'] = True
+    else:
+        entry['http'].close()
+
+
+def evict_idle():
+
+    '''
+    Drops idle entries and anything past MAX_SESSIONS (least recently used first), skipping entries in use.
+    Callers hold entries_lock.
+    '''
+
+    cutoff = time.time() - IDLE_TTL
+    idle = [session_id for session_id, entry in entries.items() if entry['last_used'] < cutoff and not entry['users']]
+    for session_id in idle:
+        close_entry(entries.pop(session_id))
+
+    overflow = len(entries) - MAX_SESSIONS
+    if overflow > 0:
+        unused = [session_id for session_id, entry in entries.items() if not entry['users']]  # LRU order
+        for session_id in unused[:overflow]:
+            close_entry(entries.pop(session_id))
+
+
+def get_entry(session_id):
+
+    '''
+    The cache entry for a session, created if needed and marked as just used. Callers hold entries_lock.
+    '''
+
+    evict_idle()
+    entry = entries.get(session_id)
+    if entry is None:
+        entry = {
+            'http': requests.Session(),  # keep-alive connection pool to api.spotify.com
+            'spotify': None,
+            'spotify_token_info': None,
+            'calendar': None,
+            'google_creds': None,
+            'last_used': time.time(),
+            'lock': threading.Lock(),  # held while this session's tokens are refreshed
+            'users': 0,  # jobs inside in_use()
+            'retired': False  # dropped from the table while in use; the last user closes it
+        }
+        entries[session_id] = entry
+    entry['last_used'] = time.time()
+    entries.move_to_end(session_id)
+    return entry
+
+
+@contextmanager
+def in_use(session_id):
+
+    '''
+    Keeps the session's clients from being evicted (and their HTTP session closed) while a job runs:
+    `with clients.in_use(session_id): ...`
+    '''
+
+    with entries_lock:
+        entry = get_entry(session_id)
+        entry['users'] += 1
+    try:
+        yield
+    finally:
+        with entries_lock:
+            entry['users'] -= 1
+            entry['last_used'] = time.time()
+            if entry['retired'] and not entry['users']:
+                entry['http'].close()
+
+
+def get_spotify(session_id, token_info):
+
+    '''
+    spotipy client for this session, on the session's keep-alive HTTP connection.
+
+    session_id (string): session uuid from main.py
+    token_info (dict): Spotify token_info (access_token, refresh_token, expires_at)
+    '''
+
+    with entries_lock:
+        entry = get_entry(session_id)
+
+    with entry['lock']:
+        # Prefer whichever token is fresher: the caller's, or one we refreshed earlier
+        cached = entry['spotify_token_info']
+        if cached and cached.get('expires_at', 0) > token_info.get('expires_at', 0):
+            token_info = cached
+
+        if spotify_token_expiring(token_info) and token_info.get('refresh_token'):
+            token_info = refresh_spotify_token_info(token_info)
+
+        if cached is None or entry['spotify'] is None or cached['access_token'] != token_info['access_token']:
+            entry['spotify'] = spotipy.Spotify(auth=token_info['access_token'], requests_session=entry['http'])
+        entry['spotify_token_info'] = token_info
+        return entry['spotify']
+
+
+def get_calendar(session_id, google_credentials):
+
+    '''
+    Google Calendar service for this session, built from the on-disk discovery document.
+
+    session_id (string): session uuid from main.py
+    google_credentials (dict): credentials in main.py's credentials_to_dict format
+    '''
+
+    with entries_lock:
+        entry = get_entry(session_id)
+
+    with entry['lock']:
+        creds = entry['google_creds']
+        if creds is None or creds.refresh_token != google_credentials.get('refresh_token'):
+            creds = Credentials(**google_credentials)
+            entry['google_creds'] = creds
+            entry['calendar'] = build_from_document(calendar_discovery_document(), credentials=creds)
+
+        # Same Credentials object the service's HTTP client holds, so refreshing it updates the service too
+        refresh_google_credentials(creds)
+        return entry['calendar']
+
+
+def get_google_credentials(session_id):
+
+    '''
+    The Credentials object behind this session's Calendar service (None if there isn't one yet).
+    '''
+
+    with entries_lock:
+        entry = entries.get(session_id)
+    if entry is None:
+        return None
+    with entry['lock']:
+        return entry['google_creds']
+
+
+def forget(session_id):
+    with entries_lock:
+        entry = entries.pop(session_id, None)
+        if entry:
+            close_entry(entry)
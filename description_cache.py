@@ -0,0 +1,131 @@
+'''
+Cache of validated playlist descriptions, keyed by the set of calendar events they were written from.
+
+A description only depends on the event titles logic.py hands to nlp.process(), so two windows with the same
+events (in any order, any casing) can share one. Entries live in an in-memory LRU with a TTL, and every
+entry keeps a few validated sentences so repeat hits don't always read the same. Setting
+DESCRIPTION_CACHE_DB in .env also backs the cache with a SQLite file that survives restarts.
+'''
+
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+MAX_ENTRIES = 1024
+TTL_SECONDS = 7 * 24 * 60 * 60
+MAX_CANDIDATES_PER_KEY = 5
+
+DB_PATH = os.getenv('DESCRIPTION_CACHE_DB')  # optional persistent backing store
+
+entries = OrderedDict()  # key -> {'created': epoch, 'candidates': [sentence, ...]}
+entries_lock = threading.Lock()
+
+
+def cache_key(event_descriptions):
+
+    '''
+    Hash of the normalized event set: titles split on commas, trimmed, lowercased, de-duplicated and sorted.
+
+    event_descriptions (string): comma-joined event summaries, as passed to nlp.process()
+    '''
+
+    titles = sorted({title.strip().lower() for title in event_descriptions.split(',') if title.strip()})
+    return hashlib.sha256('\n'.join(titles).encode('utf-8')).hexdigest()
+
+
+def connect():
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS descriptions (
+            key TEXT NOT NULL,
+            sentence TEXT NOT NULL,
+            created INTEGER NOT NULL,
+            PRIMARY KEY (key, sentence)
+        )
+    ''')
+    return conn
+
+
+def load_persisted(key):
+    conn = connect()
+    try:
+        rows = conn.execute('SELECT sentence, created FROM descriptions WHERE key = ? AND created > ? ORDER BY created',
+                            (key, int(time.time() - TTL_SECONDS))).fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        return None
+    return {'created': min(created for _, created in rows), 'candidates': [sentence for sentence, _ in rows][-MAX_CANDIDATES_PER_KEY:]}
+
+
+def persist(key, sentences):
+    conn = connect()
+    try:
+        with conn:
+            now = int(time.time())
+            conn.executemany('INSERT OR IGNORE INTO descriptions (key, sentence, created) VALUES (?, ?, ?)',
+                             [(key, sentence, now) for sentence in sentences])
+            conn.execute('DELETE FROM descriptions WHERE created <= ?', (now - TTL_SECONDS,))
+    finally:
+        conn.close()
+
+
+def remember(key, entry):
+    entries[key] = entry
+    entries.move_to_end(key)
+    while len(entries) > MAX_ENTRIES:
+        entries.popitem(last=False)
+
+
+def get(event_descriptions):
+
+    '''
+    A cached description for this event set (picked at random among the stored candidates), or None.
+    '''
+
+    key = cache_key(event_descriptions)
+
+    with entries_lock:
+        entry = entries.get(key)
+        if entry and time.time() - entry['created'] > TTL_SECONDS:
+            del entries[key]
+            entry = None
+        if entry:
+            entries.move_to_end(key)
+            return random.choice(entry['candidates'])
+
+    if DB_PATH:
+        entry = load_persisted(key)
+        if entry:
+            with entries_lock:
+                remember(key, entry)
+            return random.choice(entry['candidates'])
+
+    return None
+
+
+def add(event_descriptions, sentences):
+
+    '''
+    Stores validated sentences for this event set, keeping at most MAX_CANDIDATES_PER_KEY of the newest.
+    '''
+
+    sentences = [sentence for sentence in sentences if sentence]
+    if not sentences:
+        return
+
+    key = cache_key(event_descriptions)
+    with entries_lock:
+        entry = entries.get(key) or {'created': time.time(), 'candidates': []}
+        for sentence in sentences:
+            if sentence not in entry['candidates']:
+                entry['candidates'].append(sentence)
+        entry['candidates'] = entry['candidates'][-MAX_CANDIDATES_PER_KEY:]
+        remember(key, entry)
+
+    if DB_PATH:
+        persist(key, sentences)
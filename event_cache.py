@@ -0,0 +1,251 @@
+'''
+Per-user local cache of Google Calendar events, stored in SQLite under .event_caches/.
+
+The first run does one full events.list over the span of the user's library. After that, every run only asks
+Google for what changed since last time, using the nextSyncToken from the previous sync (usually one cheap
+request with no items). Window lookups for playlist candidates are then answered from the cache through
+an index on event start times, without calling the Calendar API at all.
+'''
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from googleapiclient.errors import HttpError
+
+import rate_limit
+
+CACHE_DIR = '.event_caches'
+FULL_SYNC_TTL = 24 * 60 * 60  # only used if Google didn't hand back a sync token
+EVENTS_PER_WINDOW = 10  # same cap as the Calendar lookups (maxResults)
+
+user_locks = {}
+user_locks_lock = threading.Lock()
+
+
+def user_lock(username):
+    with user_locks_lock:
+        return user_locks.setdefault(username, threading.Lock())
+
+
+def connect(username):
+
+    '''
+    Opens (creating if needed) the user's cache database.
+    '''
+
+    if not os.path.exists(CACHE_DIR):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+
+    # Display names can hold characters that don't belong in file names
+    filename = hashlib.sha1(username.encode('utf-8')).hexdigest() + '.sqlite3'
+    conn = sqlite3.connect(os.path.join(CACHE_DIR, filename))
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS events (
+            id TEXT PRIMARY KEY,
+            start_epoch INTEGER NOT NULL,
+            end_epoch INTEGER NOT NULL,
+            start TEXT NOT NULL,
+            summary TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS events_start ON events (start_epoch);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    ''')
+    return conn
+
+
+def get_meta(conn, key):
+    row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(conn, key, value):
+    conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, None if value is None else str(value)))
+
+
+def event_time_to_epoch(event_time, calendar_timezone):
+
+    '''
+    UTC epoch seconds for an event's start/end ({'dateTime': ...} or, for all-day events, {'date': ...}).
+    '''
+
+    if 'dateTime' in event_time:
+        return int(datetime.fromisoformat(event_time['dateTime'].replace('Z', '+00:00')).timestamp())
+
+    # All-day events start at midnight in the calendar's own timezone
+    day = datetime.fromisoformat(event_time['date'])
+    return int(day.replace(tzinfo=ZoneInfo(calendar_timezone)).timestamp())
+
+
+def store_events(conn, events, calendar_timezone):
+
+    '''
+    Upserts changed events and deletes cancelled ones.
+    '''
+
+    for event in events:
+        if event.get('status') == 'cancelled':
+            conn.execute('DELETE FROM events WHERE id = ?', (event['id'],))
+            continue
+        if 'start' not in event or 'end' not in event:
+            continue
+
+        conn.execute('INSERT OR REPLACE INTO events (id, start_epoch, end_epoch, start, summary) VALUES (?, ?, ?, ?, ?)', (
+            event['id'],
+            event_time_to_epoch(event['start'], calendar_timezone),
+            event_time_to_epoch(event['end'], calendar_timezone),
+            event['start'].get('dateTime', event['start'].get('date')),
+            event.get('summary', '')
+        ))
+
+
+def list_all_pages(service, **params):
+
+    '''
+    Runs events.list through every page. Returns (items, nextSyncToken).
+    '''
+
+    items = []
+    page_token = None
+    while True:
+        request = service.events().list(calendarId='primary', singleEvents=True, pageToken=page_token, **params)
+        result = rate_limit.call('calendar', 'events.list', request.execute)
+        items.extend(result.get('items', []))
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return items, result.get('nextSyncToken')
+
+
+def full_sync(service, conn, calendar_timezone, span_start, span_end):
+    time_min = datetime.fromtimestamp(span_start, ZoneInfo('UTC')).isoformat()
+    time_max = datetime.fromtimestamp(span_end, ZoneInfo('UTC')).isoformat()
+    items, sync_token = list_all_pages(service, timeMin=time_min, timeMax=time_max, maxResults=2500)
+
+    conn.execute('DELETE FROM events')
+    store_events(conn, items, calendar_timezone)
+    set_meta(conn, 'sync_token', sync_token)
+    set_meta(conn, 'span_start', span_start)
+    set_meta(conn, 'span_end', span_end)
+    set_meta(conn, 'synced_at', int(time.time()))
+    return len(items)
+
+
+def incremental_sync(service, conn, calendar_timezone, sync_token, span_end):
+    items, next_sync_token = list_all_pages(service, syncToken=sync_token)
+    store_events(conn, items, calendar_timezone)
+    set_meta(conn, 'sync_token', next_sync_token)
+    set_meta(conn, 'span_end', max(int(get_meta(conn, 'span_end') or 0), span_end))  # deltas aren't time-bounded
+    set_meta(conn, 'synced_at', int(time.time()))
+    return len(items)
+
+
+def sync_events(service, username, calendar_timezone, span_start, span_end):
+
+    '''
+    Makes sure the user's cache covers [span_start, span_end] and is up to date.
+
+    service (Resource): Google Calendar API service
+    username (string): whose cache
+    calendar_timezone (string): Google timezone label, for all-day events
+    span_start, span_end (int): UTC epoch seconds the cache must cover (the library's date span)
+
+    A syncToken delta brings in every change since the last sync whatever its date, so only a library that now
+    reaches further back than span_start needs another full sync; span_end just moves forward with each delta.
+
+    Returns ('full' | 'incremental' | 'fresh', events_received).
+    '''
+
+    with user_lock(username):
+        conn = connect(username)
+        try:
+            with conn:
+                sync_token = get_meta(conn, 'sync_token')
+                cached_start = get_meta(conn, 'span_start')
+                synced_at = get_meta(conn, 'synced_at')
+
+                covered = cached_start is not None and int(cached_start) <= span_start
+
+                #1. NEVER SYNCED, OR THE LIBRARY NOW REACHES FURTHER BACK THAN WHAT WE CACHED: FULL SYNC
+                if not covered:
+                    return 'full', full_sync(service, conn, calendar_timezone, span_start, span_end)
+
+                #2. NO SYNC TOKEN TO WORK WITH: TRUST THE CACHE FOR A WHILE, THEN RE-SYNC IN FULL
+                if not sync_token:
+                    if time.time() - int(synced_at) < FULL_SYNC_TTL:
+                        return 'fresh', 0
+                    return 'full', full_sync(service, conn, calendar_timezone, span_start, span_end)
+
+                #3. DELTA SINCE LAST TIME; GOOGLE ANSWERS 410 GONE WHEN THE TOKEN HAS EXPIRED
+                try:
+                    return 'incremental', incremental_sync(service, conn, calendar_timezone, sync_token, span_end)
+                except HttpError as e:
+                    if e.resp.status != 410:
+                        raise
+                    return 'full', full_sync(service, conn, calendar_timezone, span_start, span_end)
+        finally:
+            conn.close()
+
+
+def cached_span(username):
+
+    '''
+    The (span_start, span_end) UTC epoch seconds the user's cache was last fully synced over, or None if it never was.
+    '''
+
+    conn = connect(username)
+    try:
+        span_start, span_end = get_meta(conn, 'span_start'), get_meta(conn, 'span_end')
+    finally:
+        conn.close()
+    if span_start is None or span_end is None:
+        return None
+    return int(span_start), int(span_end)
+
+
+def fetch_windows(username, windows):
+
+    '''
+    Answers window lookups from the cache.
+
+    windows (list): (start, end) UTC epoch second pairs
+
+    Returns one list of (start, summary) tuples per window, like logic.gcal_event_fetch_batch: events overlapping
+    the window, earliest first, at most EVENTS_PER_WINDOW.
+    '''
+
+    conn = connect(username)
+    try:
+        # Bounding the start-time scan by the longest event keeps each lookup a narrow index range
+        longest = conn.execute('SELECT MAX(end_epoch - start_epoch) FROM events').fetchone()[0] or 0
+
+        window_events = []
+        for window_start, window_end in windows:
+            rows = conn.execute('''
+                SELECT start, summary FROM events
+                WHERE start_epoch >= ? AND start_epoch < ? AND end_epoch > ? AND summary != ''
+                ORDER BY start_epoch LIMIT ?
+            ''', (window_start - longest, window_end, window_start, EVENTS_PER_WINDOW)).fetchall()
+            window_events.append([(start, summary) for start, summary in rows])
+        return window_events
+    finally:
+        conn.close()
+
+
+def event_starts(username):
+
+    '''
+    Sorted UTC epoch start times of every cached (titled) event, for scoring many windows at once.
+    '''
+
+    conn = connect(username)
+    try:
+        return [row[0] for row in conn.execute("SELECT start_epoch FROM events WHERE summary != '' ORDER BY start_epoch")]
+    finally:
+        conn.close()
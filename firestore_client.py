@@ -0,0 +1,98 @@
+'''
+Process-wide Firestore client.
+
+The Firebase app (certificate load, gRPC channel, TLS handshake) is set up once, the first time any job asks for
+the database, and every job after that reuses the same client. The Firestore client is safe to share across the
+worker threads in jobs.py. A small daemon thread pings Firestore every KEEPALIVE_SECONDS so the channel stays
+warm between clicks, and the ping timings double as health/latency stats (served at /health/firestore).
+'''
+
+import os
+import threading
+import time
+
+import firebase_admin
+from firebase_admin import credentials
+from firebase_admin import firestore
+
+CREDENTIALS_FILE = os.getenv('FIREBASE_CREDENTIALS_FILE', 'capsulev3-firebase-adminsdk-rc1r0-4e44de2827.json')
+KEEPALIVE_SECONDS = 60
+
+client = None
+client_lock = threading.Lock()
+
+stats_lock = threading.Lock()
+stats = {
+    'initialized_at': None,
+    'init_seconds': None,
+    'pings': 0,
+    'ping_failures': 0,
+    'last_ping_ms': None,
+    'total_ping_ms': 0.0,
+    'last_error': None
+}
+
+
+def get_db():
+
+    '''
+    The shared Firestore client, initializing the Firebase app on first use.
+    '''
+
+    global client
+    if client is not None:
+        return client
+
+    with client_lock:
+        if client is None:
+            started = time.perf_counter()
+            try:
+                app = firebase_admin.get_app()
+            except ValueError:
+                app = firebase_admin.initialize_app(credentials.Certificate(CREDENTIALS_FILE))
+            db = firestore.client(app)
+
+            with stats_lock:
+                stats['initialized_at'] = time.time()
+                stats['init_seconds'] = time.perf_counter() - started
+
+            client = db
+            threading.Thread(target=keepalive, name='firestore-keepalive', daemon=True).start()
+    return client
+
+
+def ping():
+
+    '''
+    One tiny read to exercise the channel. Returns the round trip in milliseconds, or None if it failed.
+    '''
+
+    started = time.perf_counter()
+    try:
+        get_db().collection('_health').document('ping').get()
+    except Exception as e:
+        with stats_lock:
+            stats['ping_failures'] += 1
+            stats['last_error'] = str(e)
+        return None
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    with stats_lock:
+        stats['pings'] += 1
+        stats['last_ping_ms'] = elapsed_ms
+        stats['total_ping_ms'] += elapsed_ms
+    return elapsed_ms
+
+
+def keepalive():
+    while True:
+        ping()
+        time.sleep(KEEPALIVE_SECONDS)
+
+
+def get_stats():
+    with stats_lock:
+        snapshot = dict(stats)
+    snapshot['ready'] = client is not None
+    snapshot['avg_ping_ms'] = snapshot['total_ping_ms'] / snapshot['pings'] if snapshot['pings'] else None
+    return snapshot
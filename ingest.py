@@ -0,0 +1,111 @@
+'''
+Bulk ingestion of a user's liked songs into Firestore.
+
+Songs are grouped into WriteBatch commits of up to 500 writes (Firestore's per-commit limit) instead of
+one collection_ref.add() round trip per track. Every song document gets a deterministic id derived from
+its trackURI, so re-running an interrupted import overwrites the same documents instead of duplicating them.
+'''
+
+import hashlib
+import time
+
+import metrics
+
+BATCH_SIZE = 500  # max writes Firestore accepts in a single commit
+
+
+def song_doc_id(track_uri):
+
+    '''
+    Deterministic Firestore document id for a track.
+
+    track_uri (string): Spotify URI, e.g. "spotify:track:6rqhFgbbKwnb9MLmUQDhG6"
+    '''
+
+    # Regular tracks: the 22-char base62 id is already unique and safe as a document id
+    if track_uri.startswith('spotify:track:'):
+        return track_uri.rsplit(':', 1)[-1]
+
+    # Local files etc. can carry characters Firestore ids don't allow, so hash those
+    return hashlib.sha1(track_uri.encode('utf-8')).hexdigest()
+
+
+@metrics.traced('add_songs_db')
+def write_songs_batched(db, collection_name, songs, batch_size=BATCH_SIZE, on_commit=None):
+
+    '''
+    Writes songs to db.collection(collection_name) in batched commits and reports throughput.
+
+    db (Client): Firestore client
+    collection_name (string): user collection to write to
+    songs (iterable): song_data dicts ({'addedDate', 'addedEpoch', 'trackURI'}); can be a generator, writes start
+                      as soon as the first batch is full
+    batch_size (int): writes per commit, capped at BATCH_SIZE
+    on_commit (function): called with the number of songs written so far after every commit (for checkpoints)
+
+    Returns a stats dict: songs, commits, commit_seconds, elapsed, songs_per_sec.
+    '''
+
+    batch_size = min(batch_size, BATCH_SIZE)
+    collection_ref = db.collection(collection_name)
+
+    songs_written = 0
+    commits = 0
+    commit_seconds = 0.0
+    started = time.perf_counter()
+
+    def commit(batch):
+        nonlocal commits, commit_seconds
+        commit_started = time.perf_counter()
+        with metrics.external('firestore', 'batch.commit'):
+            batch.commit()
+        commit_seconds += time.perf_counter() - commit_started
+        commits += 1
+        if on_commit is not None:
+            on_commit(songs_written)
+
+    batch = db.batch()
+    pending = 0
+    for song_data in songs:
+        batch.set(collection_ref.document(song_doc_id(song_data['trackURI'])), song_data)
+        pending += 1
+        songs_written += 1
+
+        if pending == batch_size:
+            commit(batch)
+            batch = db.batch()
+            pending = 0
+
+    if pending:
+        commit(batch)
+
+    elapsed = time.perf_counter() - started
+    return {
+        'songs': songs_written,
+        'commits': commits,
+        'commit_seconds': commit_seconds,
+        'elapsed': elapsed,
+        'songs_per_sec': songs_written / elapsed if elapsed > 0 else 0.0
+    }
+
+
+def delete_songs_batched(db, collection_name, doc_ids, batch_size=BATCH_SIZE):
+
+    '''
+    Deletes the given song documents from db.collection(collection_name) in batched commits.
+
+    Returns the number of documents deleted.
+    '''
+
+    batch_size = min(batch_size, BATCH_SIZE)
+    collection_ref = db.collection(collection_name)
+    doc_ids = list(doc_ids)
+
+    for start in range(0, len(doc_ids), batch_size):
+        batch = db.batch()
+        for doc_id in doc_ids[start:start + batch_size]:
+            batch.delete(collection_ref.document(doc_id))
+        with metrics.external('firestore', 'batch.commit'):
+            batch.commit()
+
+    return len(doc_ids)
@@ -0,0 +1,322 @@
+'''
+In-process job engine for playlist generation.
+
+Instead of forking a fresh `python logic.py` interpreter on every click, main.py hands the work
+to a small, bounded thread pool that lives as long as the Flask app does. Every job gets an id
+that the frontend can poll through /jobs/<job_id>. The number of jobs that can be queued or running
+at once is capped, so a burst of clicks gets turned away instead of piling up.
+
+While a job runs, code on its worker thread can call progress(stage, ...) to record a stage transition. Every job
+keeps its list of stage events (with timings), which main.py streams to the loading screen over Server-Sent Events.
+
+With CAPSULE_EXECUTION=async, jobs are coroutines instead (see async_pipeline.py), all running as tasks on one event
+loop thread. Their blocking client calls still run on threads (ASYNC_IO_THREADS of them), but a job only holds one
+for the duration of a call; everything else it waits on happens on the loop. Those jobs can be cancelled, and a
+new job can be chained to start only once the one it replaces has fully stopped.
+'''
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# POOL SIZING (both overridable from .env)
+MAX_WORKERS = int(os.getenv('CAPSULE_MAX_WORKERS', '4'))
+MAX_PENDING = int(os.getenv('CAPSULE_MAX_PENDING', '16'))  # queued + running
+
+# HOW LONG FINISHED JOBS STAY AVAILABLE FOR POLLING (seconds)
+JOB_TTL = 15 * 60
+
+# ASYNC MODE SIZING
+EXECUTION_MODE = os.getenv('CAPSULE_EXECUTION', 'threads')  # 'threads' or 'async'
+MAX_ASYNC_JOBS = int(os.getenv('CAPSULE_MAX_ASYNC_JOBS', '256'))  # queued + running coroutine jobs
+# Threads the blocking client calls run on: enough for every per-upstream slot in async_pipeline.UPSTREAM_LIMITS
+# (16 + 8 + 32 + 8) at once, so those semaphores, not this pool, are where calls queue
+ASYNC_IO_THREADS = int(os.getenv('CAPSULE_ASYNC_IO_THREADS', '64'))
+
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='capsule-job')
+slots = threading.BoundedSemaphore(MAX_PENDING)
+
+jobs = {}
+jobs_lock = threading.Lock()
+
+# STAGE EVENTS: which job the current worker thread (or asyncio task) is running, and a condition followers wait on
+current = contextvars.ContextVar('capsule_job', default=None)
+events_cond = threading.Condition(threading.RLock())
+HEARTBEAT_SECONDS = 15
+
+# ASYNC MODE: the event loop (started on first use) and the task behind every unfinished coroutine job
+loop = None
+loop_lock = threading.Lock()
+async_slots = threading.BoundedSemaphore(MAX_ASYNC_JOBS)
+tasks = {}  # job_id -> asyncio.Task, only touched from the loop thread
+
+
+def prune_jobs():
+
+    '''
+    Drops finished jobs older than JOB_TTL so the job table doesn't grow forever.
+    '''
+
+    cutoff = time.time() - JOB_TTL
+    with jobs_lock:
+        for job_id in [job_id for job_id, job in jobs.items() if job['finished'] and job['finished'] < cutoff]:
+            del jobs[job_id]
+
+
+def submit(fn, *args, **kwargs):
+
+    '''
+    Queues fn(*args, **kwargs) on the worker pool.
+
+    Returns the new job id, or None if the pool is already at MAX_PENDING jobs (backpressure).
+    '''
+
+    if not slots.acquire(blocking=False):
+        return None
+
+    job = new_job()
+    job_id = job['id']
+
+    try:
+        executor.submit(run, job, fn, args, kwargs)
+    except RuntimeError:
+        # executor is shutting down
+        slots.release()
+        with jobs_lock:
+            del jobs[job_id]
+        return None
+
+    return job_id
+
+
+def new_job():
+
+    '''
+    Registers a fresh queued job and returns it.
+    '''
+
+    prune_jobs()
+
+    job = {
+        'id': uuid.uuid4().hex,
+        'status': 'queued',
+        'created': time.time(),
+        'started': None,
+        'finished': None,
+        'result': None,
+        'error': None,
+        'events': []
+    }
+    with jobs_lock:
+        jobs[job['id']] = job
+    record_event(job, 'queued')
+    return job
+
+
+def start(job):
+    job['status'] = 'running'
+    job['started'] = time.time()
+    record_event(job, 'started')
+
+
+def finish(job):
+    with events_cond:  # finished and the final event land together, so followers never miss it
+        job['finished'] = time.time()
+        record_event(job, job['status'])
+    metrics.observe('capsule_job_seconds', job['finished'] - job['created'], status=job['status'])
+
+
+def run(job, fn, args, kwargs):
+
+    '''
+    Worker-side wrapper: runs the job, records how it went, and always frees its slot.
+    '''
+
+    token = current.set(job)
+    start(job)
+    try:
+        job['result'] = fn(*args, **kwargs)
+        job['status'] = 'done'
+    except Exception as e:
+        print(f"Job {job['id']} failed: {e}")
+        job['error'] = str(e)
+        job['status'] = 'failed'
+    finally:
+        current.reset(token)
+        finish(job)
+        slots.release()
+
+
+# ASYNC MODE
+def get_loop():
+
+    '''
+    The event loop async jobs run on, started in a daemon thread the first time it's needed.
+    '''
+
+    global loop
+    with loop_lock:
+        if loop is None:
+            new_loop = asyncio.new_event_loop()
+            new_loop.set_default_executor(ThreadPoolExecutor(max_workers=ASYNC_IO_THREADS,
+                                                             thread_name_prefix='capsule-async-io'))
+            threading.Thread(target=new_loop.run_forever, name='capsule-async', daemon=True).start()
+            loop = new_loop
+    return loop
+
+
+def submit_async(coro_fn, *args, after=None, **kwargs):
+
+    '''
+    Runs coro_fn(*args, **kwargs) as a task on the async jobs loop.
+
+    after (string): id of a job this one replaces; the new job waits until that one has fully stopped
+                    (e.g. cancelled, with its in-flight calls drained) before starting.
+
+    Returns the new job id, or None if MAX_ASYNC_JOBS are already queued or running (backpressure).
+    '''
+
+    if not async_slots.acquire(blocking=False):
+        return None
+
+    job = new_job()
+    event_loop = get_loop()
+
+    def create_task():
+        tasks[job['id']] = event_loop.create_task(run_async(job, coro_fn, args, kwargs, tasks.get(after)))
+
+    event_loop.call_soon_threadsafe(create_task)
+    return job['id']
+
+
+async def run_async(job, coro_fn, args, kwargs, previous=None):
+
+    '''
+    Loop-side wrapper: waits for the job it replaces, runs the coroutine, records how it went, frees its slot.
+    '''
+
+    current.set(job)  # each task runs in its own copy of the context
+    try:
+        if previous is not None:
+            await asyncio.wait({previous})
+        start(job)
+        job['result'] = await coro_fn(*args, **kwargs)
+        job['status'] = 'done'
+    except asyncio.CancelledError:
+        job['status'] = 'cancelled'
+    except Exception as e:
+        print(f"Job {job['id']} failed: {e}")
+        job['error'] = str(e)
+        job['status'] = 'failed'
+    finally:
+        tasks.pop(job['id'], None)
+        finish(job)
+        async_slots.release()
+
+
+def cancel(job_id):
+
+    '''
+    Asks an async job to stop (e.g. the user clicked "Make Another" again). Returns False for thread pool jobs
+    and jobs that already finished; those can't be called off.
+    '''
+
+    job = get(job_id)
+    if job is None or job['finished'] or loop is None:
+        return False
+
+    def cancel_task():
+        task = tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+
+    loop.call_soon_threadsafe(cancel_task)
+    return True
+
+
+def record_event(job, stage, **info):
+
+    '''
+    Appends a stage event to the job: seconds since the job was queued ('at'), time spent in the previous stage
+    ('previous_stage_seconds') and any extra info, then wakes up everyone following the job.
+    '''
+
+    at = round(time.time() - job['created'], 3)
+    with events_cond:
+        previous = job['events'][-1] if job['events'] else None
+        event = {
+            'stage': stage,
+            'at': at,
+            'previous_stage_seconds': round(at - previous['at'], 3) if previous else 0.0
+        }
+        event.update(info)
+        job['events'].append(event)
+        events_cond.notify_all()
+
+
+def progress(stage, **info):
+
+    '''
+    Records a stage transition for the job running on this thread. Does nothing outside a job (e.g. `python logic.py`).
+    '''
+
+    job = current.get()
+    if job is not None:
+        record_event(job, stage, **info)
+
+
+def follow(job_id):
+
+    '''
+    Yields the job's stage events as they happen, starting from the first one, until the job is done, failed or
+    cancelled.
+    Yields None every HEARTBEAT_SECONDS with nothing new, so the caller can keep its connection alive.
+    '''
+
+    with jobs_lock:
+        job = jobs.get(job_id)
+    if job is None:
+        return
+
+    sent = 0
+    while True:
+        with events_cond:
+            if sent == len(job['events']) and not job['finished']:
+                events_cond.wait(HEARTBEAT_SECONDS)
+            new_events = job['events'][sent:]
+            finished = job['finished'] is not None
+
+        if not new_events:
+            if finished:
+                return
+            yield None
+            continue
+
+        for event in new_events:
+            yield event
+        sent += len(new_events)
+
+        if finished and sent == len(job['events']):
+            return
+
+
+def get(job_id):
+
+    '''
+    Returns a snapshot of the job's state (safe to jsonify), or None for unknown/expired ids.
+    '''
+
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return None
+    with events_cond:
+        snapshot = dict(job)
+        snapshot['events'] = list(job['events'])
+    return snapshot
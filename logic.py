@@ -1,25 +1,17 @@
-#for spotify
+#for spotify + google (api clients cached per session)
 import os
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-from spotipy.oauth2 import SpotifyOAuth
+import json
+from clients import get_calendar, get_spotify, in_use
+import token_store
+from spotify_writer import write_playlist
 
 #for firebase
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import firestore
+from firestore_client import get_db
 
 #for datetime conversion functions
-from timezone import timezone_dict
-from datetime import datetime, timedelta
-from dateutil import parser, tz
-import pytz
-import random
-
-#for google
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-import json
+from timezone import convert_page
+from datetime import datetime, timezone as dt_timezone
+import time
 
 #for openai
 import openai
@@ -27,140 +19,129 @@ from dotenv import load_dotenv
 import os
 from nlp import generate, prepare, process
 
+#for keeping the user's firestore collection in sync with their liked songs
+from sync import sync_library
+from song_index import get_song_index, window_at
+
+#for choosing capsule windows (every window scored in one vectorized pass)
+from window_scoring import sample_windows, score_windows
+
+#for answering calendar window lookups locally
+from event_cache import event_starts, fetch_windows, sync_events
+
+#for background precompute of ready-to-write playlists (+ stage progress events)
+import jobs
+import metrics
+import rate_limit
+from candidates import invalidate as invalidate_candidates, pool_size as candidate_pool_size, pop_candidate, start_precompute
+
 load_dotenv()
 
+SECONDS_PER_DAY = 24 * 60 * 60
+
+PLAYLIST_TITLE = "Capsule"
+PLAYLIST_LENGTH = 20
+CANDIDATE_COUNT = 10
+NO_EVENTS_DESCRIPTION = "You don't have enough events on your calendar for this to work! Silly goose. Here's a playlist anyways."
 
-def format_date_for_google_calendar(date_str, calendar_timezone):
+
+def format_date_for_google_calendar(epoch):
 
     '''
-    Formats a date string to UTC in RFC3339 format for Google Calendar API calls.
+    Formats a date to UTC in RFC3339 format for Google Calendar API calls.
 
-    date_str (string): datetime the format "2022-09-13T19:11:26-5:00"
-    calendar_timezone (string): Google timezone label (dictionary of all options timezone.py)
+    epoch (int): UTC epoch seconds, as stored in a song's addedEpoch
     '''
 
-    local_dt = parser.parse(date_str)
-    local_tz = tz.gettz(calendar_timezone)
-    local_dt = local_dt.astimezone(local_tz)
-    utc_dt = local_dt.astimezone(tz.UTC)
-    return utc_dt.isoformat()
+    return datetime.fromtimestamp(epoch, dt_timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
-def spot_to_gcal_date(date, timezone):
+@metrics.traced('gcal_event_fetch_batch')
+def gcal_event_fetch_batch(service, windows):
 
     '''
-    Converts Spotify date format to Google-calendar compatible date format. 
+    Fetches events for several (start, end) windows in a single batched Google Calendar HTTP request.
+
+    service (Resource): Google Calendar API service
+    windows (list): (start, end) UTC epoch second pairs
 
-    date (datetime): date data from Spotify API call
-    timezone (string): Google Calendar timzeone label (dictionary of options in timezone.py)
+    Returns one event list per window, in the same order; a window whose sub-request failed gets [].
     '''
 
-    spotify_date_format = "%Y-%m-%dT%H:%M:%SZ"
-    date_obj = datetime.strptime(date, spotify_date_format)
-    utc = pytz.utc
-    date_obj = utc.localize(date_obj)
+    window_events = [[] for _ in windows]
+    if not windows:
+        return window_events
 
-    if timezone in timezone_dict:
-        timezone_offset = timezone_dict[timezone]
-    else:
-        raise ValueError("Timezone not found in timezone_dict")
-
-    hours_offset = int(timezone_offset.split(':')[0])
-    minutes_offset = int(timezone_offset.split(':')[1])
-    offset_delta = timedelta(hours=hours_offset, minutes=minutes_offset)
-    target_timezone = pytz.FixedOffset(offset_delta.total_seconds() // 60)
-    target_date_obj = date_obj.astimezone(target_timezone)
-    formatted_date = target_date_obj.strftime("%Y-%m-%dT%H:%M:%S")
-    formatted_timezone_offset = f"{offset_delta.days * 24 + offset_delta.seconds // 3600:02d}:{abs(offset_delta.seconds // 60 % 60):02d}"
-    return f"{formatted_date}{formatted_timezone_offset}"
-
-def load_google_credentials(creds_file):
-    with open(creds_file, 'r') as infile:
-        creds_data = json.load(infile)
-        return Credentials(**creds_data)
-
-def gcal_event_fetch(service, start, end, calendar_timezone):
-    """Fetch events from Google Calendar between start and end dates."""
-    # Format the start and end dates for the Google Calendar API
-    time_min = format_date_for_google_calendar(start, calendar_timezone)
-    time_max = format_date_for_google_calendar(end, calendar_timezone)
-
-    # Fetch events within the defined time window
-    events_result = service.events().list(
-        calendarId='primary', timeMin=time_min, timeMax=time_max,
-        maxResults=10, singleEvents=True, orderBy='startTime').execute()
-    events = events_result.get('items', [])
-
-    # Process and return the events
-    if not events:
-        return []
-    else:
-        return [(event['start'].get('dateTime', event['start'].get('date')), event['summary']) for event in events]
+    def collect(request_id, response, exception):
+        if exception is not None:
+            print(f"Error fetching events for window {request_id}: {exception}")
+            if metrics.is_throttled(exception):
+                rate_limit.buckets['calendar'].throttled(exception, 0)  # so other jobs back off too
+            return
+        window_events[int(request_id)] = [(event['start'].get('dateTime', event['start'].get('date')), event['summary'])
+                                          for event in response.get('items', [])]
 
-def parse_date_part(date_str):
+    batch = service.new_batch_http_request(callback=collect)
+    for i, (start, end) in enumerate(windows):
+        batch.add(service.events().list(
+            calendarId='primary',
+            timeMin=format_date_for_google_calendar(start),
+            timeMax=format_date_for_google_calendar(end),
+            maxResults=10, singleEvents=True, orderBy='startTime'), request_id=str(i))
+    # Every sub-request counts toward the Calendar quota
+    rate_limit.call('calendar', 'events.list.batch', batch.execute, cost=len(windows))
 
-    '''
-    Extracts the date and timezone from a full date string. 
-    
-    date_str (string): datetime in the format "2022-09-13T19:11:26-5:00"
-    '''
+    return window_events
 
-    date_part, timezone = date_str.rsplit('-', 1)
-    return datetime.fromisoformat(date_part), '-' + timezone
 
-def generate_random_date(start_str, end_str):
+def tokens_from_env():
 
     '''
-    Generate a random date between start and end date strings.
-
-    start_str (string): datetime in the format "2022-09-13T19:11:26-5:00", lower bound for random date generation
-    end_str (string): same format as above, upper bound 
+    Token state for standalone `python logic.py` runs, from the environment variables the script always used.
     '''
 
-    start_date, timezone = parse_date_part(start_str)
-    end_date, _ = parse_date_part(end_str)
-    delta_days = (end_date - start_date).days
-    random_days = random.randint(0, delta_days)
-    random_date = start_date + timedelta(days=random_days)
-    return f"{random_date.strftime('%Y-%m-%d')}T00:00:00{timezone}"
-
+    tokens = {'calendar_timezone': os.getenv('GOOGLE_CALENDAR_TIMEZONE')}
+    if os.getenv('SPOTIFY_ACCESS_TOKEN'):
+        tokens['spotify_token_info'] = {'access_token': os.getenv('SPOTIFY_ACCESS_TOKEN')}
+    if os.getenv('GOOGLE_CREDENTIALS_FILE'):
+        with open(os.getenv('GOOGLE_CREDENTIALS_FILE'), 'r') as infile:
+            tokens['google_credentials'] = json.load(infile)
+    return tokens
 
-def main():
-    
-    print('RUNNING LOGIC.PY')
+def setup(session_id, store=token_store):
 
     '''
-    Any error-handling/checking in here for Spotify and Google API access is now made obscelete by token_check.py
+    Loads the session's tokens and sets up its clients (shared by main() and async_pipeline.py).
+
+    Returns a dict: sp, profile, username, service, db, calendar_timezone.
     '''
 
+    tokens = store.get(session_id) or tokens_from_env()
+    token_info = tokens.get('spotify_token_info')
+    google_credentials = tokens.get('google_credentials')
+    google_calendar_timezone = tokens.get('calendar_timezone')
+
     # CHECK FOR SPOTIFY API CALL ACCESS
-    token = os.getenv('SPOTIFY_ACCESS_TOKEN')
-    if not token:
-        print("Spotify access token is missing.")
-        return
+    if not token_info:
+        raise RuntimeError("Spotify access token is missing.")
     
-    # SPOTIFY SETUP - CURRENT ISSUE WITH AUTH PERMISSIONS
-    sp = spotipy.Spotify(auth=token)
-    username = sp.current_user()['display_name'] #get username
+    # SPOTIFY SETUP (cached per session, keep-alive HTTP, token refreshed in place)
+    sp = get_spotify(session_id, token_info)
+    profile = rate_limit.call('spotify', 'current_user', sp.current_user) #fetched once per job, reused for the playlist write
+    username = profile['display_name'] #get username
     print(F"CURRENT USER: {username}")
 
     # GCAL SETUP (incl. timezone + timeout handling)
     service = None
-    creds_file = os.getenv('GOOGLE_CREDENTIALS_FILE')
-    google_calendar_timezone = os.getenv('GOOGLE_CALENDAR_TIMEZONE')
-    if creds_file and google_calendar_timezone:
+    if google_credentials and google_calendar_timezone:
         try:
-            creds = load_google_credentials(creds_file)
-            service = build('calendar', 'v3', credentials=creds)
+            service = get_calendar(session_id, google_credentials)
         except Exception as e:
             print(f"Error setting up Google Calendar service: {e}")
     if service is None:
-        print("error")
-        exit(1)
+        raise RuntimeError("Google Calendar service setup failed.")
     
-    # FIREBASE SETUP
-    cred = credentials.Certificate('capsulev3-firebase-adminsdk-rc1r0-4e44de2827.json')
-    firebase_admin.initialize_app(cred)
-    db = firestore.client()
+    # FIREBASE SETUP (one client per process, shared by every job)
+    db = get_db()
 
     # OPENAI SETUP
     api_key = os.getenv("OPENAI_API_KEY")
@@ -168,175 +149,151 @@ def main():
         raise ValueError("API key not found in .env file")
     openai.api_key = api_key
 
+    return {'sp': sp, 'profile': profile, 'username': username, 'service': service, 'db': db,
+            'calendar_timezone': google_calendar_timezone}
 
-    # FUNCTION: check if user collection already exists 
-    def collection_exists(db, collection_name):
-        return any(db.collection(collection_name).limit(1).get())
-    
-    # FUNCTION: add song item to correct location in data hierarchy
-    def add_song_db(collection_name, song_data):
-        collection_ref = db.collection(collection_name)
-        collection_ref.add(song_data)
-    
-    # FETCH 1000 SONGS (units of 50) + ADD EACH TO DATABASE
-    if not collection_exists(db, username):
-        total_songs = 1000
-        offset = 0
-        songs_added = 0
-        while offset < total_songs:
-            #0. Init Spotify playlist to reap from
-            results = sp.current_user_saved_tracks(limit=50, offset=offset)
-
-            for item in results['items']:
-                #1. Locate song data needed 
-                track = item['track']
-                added_date = item['added_at']  
-
-                #2. Convert the Spotify date to Gcal date format
-                added_date = spot_to_gcal_date(added_date, google_calendar_timezone)
-
-                #3. Prepare song data
-                song_data = {
-                    'addedDate': added_date,
-                    'trackURI': track['uri']
-                }
-
-                #4. Add song data to database
-                add_song_db(username, song_data)
-                songs_added += 1
-
-            #5. Update the offset
-            offset += 50
-
-            #6. break loop if finished (if less than 50 items left)
-            if len(results['items']) < 50:
-                break
-    else:
-        print(f"Collection '{username}' already exists in the database.")
+def make_to_songs(google_calendar_timezone):
 
-    # PURE LOGIC
-    playlistLength = 20
-
-    #1. GET EARLIEST POSSIBLE DATE
-    db_first_song = db.collection(username).order_by('addedDate', direction=firestore.Query.ASCENDING).limit(1).get()
-    start = db_first_song[0].to_dict()['addedDate'] if db_first_song else None
-
-    #2. GET LATEST POSSIBLE DATE BASED ON PLAYLIST LENGTH
-    db_nth_song = db.collection(username).order_by('addedDate', direction=firestore.Query.DESCENDING).limit(playlistLength).get()
-    end = db_nth_song[-1].to_dict()['addedDate'] if len(db_nth_song) == playlistLength else None
-
-    #3. INITIAL rand_date DATE GENERATION
-    rand_date = generate_random_date(start, end)
-
-    #FIREBASE QUERY TO SELECT SONGS BASED ON rand_date DATE, RETURNS SONG BOOKEND DATES  
-    def generate_song_selections(collection_name, target_date, playlistLength):
-        # Query to find the song closest to the target date
-        closest_song_query = db.collection(collection_name).where('addedDate', '>=', target_date).order_by('addedDate').limit(1).get()
-        
-        closest_song_date = None
-        for doc in closest_song_query:
-            closest_song_date = doc.to_dict()['addedDate']
-
-        if closest_song_date is None:
-            return [], None, None
-
-        # Query to find the next songs after the closest song
-        next_songs_query = db.collection(collection_name).where('addedDate', '>', closest_song_date).order_by('addedDate').limit(playlistLength).get()
-        
-        next_songs = [doc.to_dict() for doc in next_songs_query]
-        tracks = [doc.to_dict()['trackURI'] for doc in next_songs_query]
-        
-        # Determine playlistStart and playlistEnd
-        playlist_dates = [song['addedDate'] for song in next_songs]
-        playlistStart = min(playlist_dates, default=None)
-        playlistEnd = max(playlist_dates, default=None)
-
-        return next_songs, playlistStart, playlistEnd, tracks
+    # FUNCTION: turn a page of liked-songs items into the song items stored in the database
+    def to_songs(items):
+        #1. Convert the Spotify dates to Gcal date format (plus UTC epoch), the whole page at once
+        added_epochs, added_dates = convert_page([item['added_at'] for item in items], google_calendar_timezone)
+
+        #2. Prepare song data
+        return [{
+            'addedDate': added_date,
+            'addedEpoch': added_epoch,
+            'trackURI': item['track']['uri']
+        } for item, added_date, added_epoch in zip(items, added_dates, added_epochs)]
+
+    return to_songs
+
+def main(session_id='standalone', store=token_store):
     
-    #4. FIND PLAYLIST SELECTIONS + Date Bookends
-    next_songs, playlistStart, playlistEnd, tracks = generate_song_selections(username, rand_date, playlistLength)
- 
-    # GCAL TIME WINDOW SEARCH
-    def gcal_event_fetch(service, start, end, calendar_timezone):
-        """Fetch events from Google Calendar between start and end dates."""
-        # Format the start and end dates for the Google Calendar API
-        time_min = format_date_for_google_calendar(start, calendar_timezone)
-        time_max = format_date_for_google_calendar(end, calendar_timezone)
-
-        # Fetch events within the defined time window
-        events_result = service.events().list(
-            calendarId='primary', timeMin=time_min, timeMax=time_max,
-            maxResults=10, singleEvents=True, orderBy='startTime').execute()
-        events = events_result.get('items', [])
-
-        # Process and return the events
-        if not events:
-            print('No events found in the specified time range.')
-            return []
-        else:
-            return [(event['start'].get('dateTime', event['start'].get('date')), event['summary']) for event in events]
+    print('RUNNING LOGIC.PY')
 
-    # WHILE-LOOP TO PROMISE GCAL EVENTS FOR EVERY PLAYLIST SELECTION
-    events = []
-    attempts = 0
-    max_attempts = 10
+    '''
+    Any error-handling/checking in here for Spotify and Google API access is now made obscelete by token_check.py
 
-    playlist_title = "Capsule"
-    playlist_description = "NLP model in development to parse your Google Calendar events into a lovely little blurb to add here. Coming soon <3"
+    Runs in-process on the jobs.py worker pool (see main.py), or standalone via `python logic.py`.
+    (async_pipeline.py runs the same steps on asyncio, with independent ones overlapped.)
+    session_id (string): session uuid; keys both the token store and the per-session client cache in clients.py
+    store (module): where this session's tokens live (token_store); standalone runs fall back to environment variables
+    Returns a dict describing the playlist that was written.
+    '''
 
-    while not events and attempts < max_attempts: 
-        events = gcal_event_fetch(service, playlistStart, playlistEnd, google_calendar_timezone)  
-        attempts += 1
+    # THE SESSION'S CACHED CLIENTS STAY OPEN UNTIL THIS JOB IS DONE WITH THEM
+    with in_use(session_id):
+        return make_capsule(session_id, store)
 
-        if events:
+def make_capsule(session_id, store):
 
-            # PACKAGE UP EVENT DESCRIPTIONS INTO ONE STRING FOR NLP PARSING LATER
-            event_descriptions = ', '.join([event[1] for event in events])
-            print(f"raw event descriptions: {event_descriptions}")
+    # SPOTIFY, GCAL, FIREBASE + OPENAI SETUP
+    session = setup(session_id, store)
+    sp, profile, username = session['sp'], session['profile'], session['username']
+    service, db, google_calendar_timezone = session['service'], session['db'], session['calendar_timezone']
+    to_songs = make_to_songs(google_calendar_timezone)
 
-            # THIS IS WHERE YOU ADD THE NLP
-            playlist_description = process(event_descriptions)
-            # print(playlist_description)
+    # SYNC LIBRARY: STREAMING FULL IMPORT THE FIRST TIME (CAPSULE_IMPORT_LIMIT SONGS, DEFAULT ALL), THEN ONLY NEWLY LIKED (AND REMOVED) SONGS
+    jobs.progress('import')
+    with metrics.span('library_sync'):
+        summary = sync_library(db, sp, username, to_songs)
+    if summary['added'] or summary['removed']:
+        invalidate_candidates(username)
+    jobs.progress('selection', **summary)
 
-        else:
-            print("No events found. Trying again...")
-            rand_date = generate_random_date(start, end)
-            next_songs, playlistStart, playlistEnd, tracks = generate_song_selections(username, rand_date, playlistLength)
+    playlist_title = PLAYLIST_TITLE
 
-    if not events:
+    # PRECOMPUTED CANDIDATE READY? THEN THE SPOTIFY WRITE IS ALL THAT'S LEFT
+    candidate = pop_candidate(username)
+    if candidate:
+        print(f"Using precomputed candidate ({candidate['score']} events)")
+        print(f"FINAL DESCRIPTION: {candidate['description']}")
+        jobs.progress('spotify_write', precomputed=True)
+        with metrics.span('spotify_write'):
+            playlist_id, _ = write_playlist(sp, profile['id'], candidate['tracks'], playlist_title, candidate['description'])
 
-        # IF NO EVENTS, GIVE USER A PLAYLIST BUT NO DESCRIPTION (BC NOT POSSIBLE)
-        playlist_description = "You don't have enough events on your calendar for this to work! Silly goose. Here's a playlist anyways."
+        # TOP UP THE POOL IN THE BACKGROUND BEFORE IT RUNS DRY
+        if candidate_pool_size(username) < 2:
+            start_precompute(get_song_index(db, username, summary['version']), username)
 
-    # EXPORT TRACK SELECTION TO SPOTIFY
-    def create_playlist(sp, track_uris, title, description):
-        """
-        Create a Spotify playlist and add tracks to it.
+        return {'playlist_id': playlist_id, 'description': candidate['description']}
 
-        Parameters:
-        sp (Spotify): The Spotify client object.
-        track_uris (list): A list of track URIs to add to the playlist.
-        title (str): The title of the playlist.
-        description (str): The description of the playlist.
-        """
+    # PURE LOGIC
+    playlistLength = PLAYLIST_LENGTH
 
-        # Get the current user's Spotify ID
-        user_id = sp.current_user()['id']
+    #0. SORTED DATE INDEX OF THE USER'S SONGS (ONE READ, THEN CACHED UNTIL THE NEXT SYNC CHANGES THE LIBRARY)
+    with metrics.span('song_index'):
+        song_index = get_song_index(db, username, summary['version'])
 
-        # Create the playlist
-        playlist = sp.user_playlist_create(user_id, title, public=True)
-        playlist_id = playlist['id']
+    #1. BRING THE LOCAL EVENT CACHE UP TO DATE FIRST, SO WINDOW SCORING KNOWS WHERE THE EVENTS ARE
+    jobs.progress('calendar')
+    event_cache_ready = False
+    starts = []
+    with metrics.span('calendar'):
+        try:
+            # Full sync over the library's span the first time, a cheap syncToken delta after that
+            span_start = song_index['epochs'][0]
+            span_end = max(song_index['epochs'][-1], int(time.time())) + SECONDS_PER_DAY
+            mode, received = sync_events(service, username, google_calendar_timezone, span_start, span_end)
+            print(f"Event cache sync ({mode}): {received} events received")
+            starts = event_starts(username)
+            event_cache_ready = True
+        except Exception as e:
+            # Cache trouble shouldn't cost the user a playlist; windows get scored on span and recency alone
+            print(f"Event cache unavailable, falling back to batched Calendar lookups: {e}")
+
+    #2. SCORE EVERY WINDOW OF playlistLength CONSECUTIVE SONGS (SPAN, EVENT DENSITY, RECENCY) IN ONE PASS,
+    #   THEN DRAW CANDIDATE WINDOWS (PLAYLIST SELECTIONS + Date Bookends) FROM THAT DISTRIBUTION, NON-OVERLAPPING
+    candidate_count = CANDIDATE_COUNT
+    with metrics.span('window_scoring'):
+        weights, _ = score_windows(song_index['epochs'], starts, playlistLength)
+        candidates = [window_at(song_index, first, playlistLength)
+                      for first in sample_windows(weights, candidate_count, playlistLength)]
+
+    #3. EVENTS FOR EVERY CANDIDATE, FROM THE LOCAL EVENT CACHE (OR ONE BATCHED CALENDAR REQUEST WITHOUT IT)
+    windows = [(playlistStart, playlistEnd) for _, playlistStart, playlistEnd, _ in candidates]
+    with metrics.span('calendar'):
+        if event_cache_ready:
+            window_events = fetch_windows(username, windows)
+        else:
+            window_events = gcal_event_fetch_batch(service, windows)
+
+    #4. TAKE THE FIRST-DRAWN WINDOW KNOWN TO HAVE EVENTS (NO MORE "NO EVENTS, TRY AGAIN" ROUND TRIPS)
+    with_events = [(candidate, events) for candidate, events in zip(candidates, window_events) if events]
+    print(f"{len(with_events)} of {len(candidates)} candidate windows have calendar events")
 
-        # Set the playlist description
-        sp.user_playlist_change_details(user_id, playlist_id, description=description)
+    playlist_description = "NLP model in development to parse your Google Calendar events into a lovely little blurb to add here. Coming soon <3"
 
-        # Add tracks to the playlist
-        sp.playlist_add_items(playlist_id, track_uris)
+    if with_events:
+        (next_songs, playlistStart, playlistEnd, tracks), events = with_events[0]
 
-        return 
-    
+        # PACKAGE UP EVENT DESCRIPTIONS INTO ONE STRING FOR NLP PARSING LATER
+        event_descriptions = ', '.join([event[1] for event in events])
+        print(f"raw event descriptions: {event_descriptions}")
+
+        # THIS IS WHERE YOU ADD THE NLP
+        jobs.progress('nlp', events=len(events))
+        with metrics.span('nlp'):
+            playlist_description = process(event_descriptions)
+    else:
+        events = []
+        next_songs, playlistStart, playlistEnd, tracks = candidates[0] if candidates else ([], None, None, [])
+
+        # IF NO EVENTS, GIVE USER A PLAYLIST BUT NO DESCRIPTION (BC NOT POSSIBLE)
+        playlist_description = NO_EVENTS_DESCRIPTION
+
+    # EXPORT TRACK SELECTION TO SPOTIFY
     print(f"FINAL DESCRIPTION: {playlist_description}")
-    create_playlist(sp, tracks, playlist_title, playlist_description)
+    jobs.progress('spotify_write', precomputed=False)
+    with metrics.span('spotify_write'):
+        playlist_id, _ = write_playlist(sp, profile['id'], tracks, playlist_title, playlist_description)
+
+    # PRECOMPUTE THE NEXT FEW CAPSULES IN THE BACKGROUND SO "MAKE ANOTHER" IS JUST A SPOTIFY WRITE
+    if event_cache_ready:
+        start_precompute(song_index, username)
+
+    return {'playlist_id': playlist_id, 'description': playlist_description}
 
 
 if __name__ == '__main__':
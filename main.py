@@ -4,11 +4,29 @@ frontend-equipped main.py flask app.
 '''
 
 # Misc imports
-from flask import Flask, session, request, redirect, url_for, render_template, jsonify, flash
+from flask import Flask, session, request, redirect, url_for, render_template, jsonify, flash, Response
 import os
-from dotenv import load_dotenv
 import json
-import subprocess
+from dotenv import load_dotenv
+
+# Playlist generation runs in-process on a bounded worker pool (or as asyncio tasks with CAPSULE_EXECUTION=async)
+import jobs
+import logic
+import async_pipeline
+import firestore_client
+
+# Spotify/Calendar clients cached per session (keyed by session['uuid']), in-process preflight
+import clients
+import token_check
+
+# Per-session OAuth tokens (instead of os.environ + a shared google_creds.json)
+import token_store
+
+# Stage spans, external call counts and latency histograms (/metrics)
+import metrics
+
+# Shared per-upstream rate limits (every Spotify/Calendar call goes through them)
+import rate_limit
 
 # FOR GOOGLE OAUTH
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
@@ -17,8 +35,6 @@ os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 from spotipy.oauth2 import SpotifyOAuth
 from google_auth_oauthlib.flow import Flow as GoogleFlow
 from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 
 # FOR SPOTIFY OAUTH 
 cache_dir = '.spotify_caches'
@@ -34,33 +50,36 @@ app.secret_key = os.getenv('FLASK_SECRET_KEY')
 os.environ['SPOTIPY_CLIENT_ID'] = os.getenv('SPOTIFY_CLIENT_ID')
 os.environ['SPOTIPY_CLIENT_SECRET'] = os.getenv('SPOTIFY_CLIENT_SECRET')
 os.environ['SPOTIPY_REDIRECT_URI'] = os.getenv('SPOTIFY_REDIRECT_URI')
-SPOTIFY_SCOPES = 'user-library-read playlist-modify-public'
+SPOTIFY_SCOPES = clients.SPOTIFY_SCOPES
 
 # Google OAuth setup
 GOOGLE_SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
 GOOGLE_CLIENT_SECRET_FILE = os.getenv('GOOGLE_CLIENT_SECRET_FILE')
 GOOGLE_REDIRECT_URI = os.getenv('GOOGLE_REDIRECT_URI')
 
+def start_job(session_id, after=None):
+    '''
+    Queues a playlist job for the session: async_pipeline.main on the event loop in async mode, logic.main on the
+    worker pool otherwise. after (async mode only) is the id of a job the new one replaces.
+    '''
+    if jobs.EXECUTION_MODE == 'async':
+        return jobs.submit_async(async_pipeline.main, session_id, after=after)
+    return jobs.submit(logic.main, session_id)
+
 def refresh_spotify_token():
-    if 'spotify_token_info' in session:
-        sp_oauth = SpotifyOAuth(
-            client_id=os.getenv("SPOTIFY_CLIENT_ID"),
-            client_secret=os.getenv("SPOTIFY_CLIENT_SECRET"),
-            redirect_uri=os.getenv("SPOTIFY_REDIRECT_URI"),  # Use the same redirect URI as in create_spotify_oauth
-            scope=SPOTIFY_SCOPES)
-        token_info = sp_oauth.refresh_access_token(session['spotify_token_info']['refresh_token'])
+    if 'spotify_token_info' in session and clients.spotify_token_expiring(session['spotify_token_info']):
+        token_info = clients.refresh_spotify_token_info(session['spotify_token_info'])
         session['spotify_token_info'] = token_info
 
-        # Save the refreshed access token as an environment variable
-        os.environ['SPOTIFY_ACCESS_TOKEN'] = token_info['access_token']
+        # Save the refreshed token where this session's jobs will read it
+        token_store.update(session['uuid'], spotify_token_info=token_info)
 
 def refresh_google_token():
     if 'google_credentials' in session:
         creds = Credentials(**session['google_credentials'])
-        if creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+        if clients.refresh_google_credentials(creds):
             session['google_credentials'] = credentials_to_dict(creds)
-            os.environ['GOOGLE_CREDENTIALS_FILE'] = 'google_creds.json'
+            token_store.update(session['uuid'], google_credentials=session['google_credentials'])
 
 def credentials_to_dict(credentials):
     return {'token': credentials.token,
@@ -91,14 +110,17 @@ def login_spotify():
 @app.route('/spotify_callback')
 def spotify_callback():
     sp_oauth = create_spotify_oauth()
+    session_uuid = session.get('uuid')
     session.clear()
+    session['uuid'] = session_uuid or os.urandom(16).hex()  # keep the uuid, it keys the client cache
     code = request.args.get('code')
     token_info = sp_oauth.get_access_token(code)
     session['auth_token'] = token_info['access_token']
+    token_check.forget(session['uuid'])
 
     #new
     session['spotify_token_info'] = token_info
-    os.environ['SPOTIFY_ACCESS_TOKEN'] = token_info['access_token']
+    token_store.update(session['uuid'], spotify_token_info=token_info)
     print("Access Token:", token_info['access_token'])
 
     return '''
@@ -135,26 +157,25 @@ def google_callback():
     flow.fetch_token(authorization_response=request.url)
     credentials = flow.credentials
     session['google_credentials'] = credentials_to_dict(credentials)
+    session.setdefault('uuid', os.urandom(16).hex())
+    token_check.forget(session['uuid'])
 
-    # Initialize Google Calendar API service
-    creds = Credentials(**session['google_credentials'])
-    service = build('calendar', 'v3', credentials=creds)
+    # Initialize Google Calendar API service (cached for this session, reused by the playlist jobs)
+    service = clients.get_calendar(session['uuid'], session['google_credentials'])
 
     # TIMEZONE DETECTION: Fetch the timezone of the primary calendar
-    calendar = service.calendars().get(calendarId='primary').execute()
+    calendar = rate_limit.call('calendar', 'calendars.get', service.calendars().get(calendarId='primary').execute)
     calendar_timezone = calendar['timeZone']
 
-    # Save credentials to a file
-    creds_data = credentials_to_dict(credentials)
-    with open('google_creds.json', 'w') as outfile:
-        json.dump(creds_data, outfile)
-
-    # Set environment variables for logic.py
-    os.environ['GOOGLE_CREDENTIALS_FILE'] = 'google_creds.json'
-    os.environ['GOOGLE_CALENDAR_TIMEZONE'] = calendar_timezone
+    # Save credentials + timezone for this session only (jobs read them from the token store)
+    session['calendar_timezone'] = calendar_timezone
+    token_store.update(session['uuid'], google_credentials=session['google_credentials'], calendar_timezone=calendar_timezone)
 
-    # Execute logic.py
-    subprocess.Popen(['python', 'logic.py'])
+    # Queue logic.py's playlist generation on the worker pool
+    job_id = start_job(session['uuid'])
+    if job_id is None:
+        print("Job pool is full, first playlist not queued.")
+    session['job_id'] = job_id
 
     return '''
     <html>
@@ -170,27 +191,82 @@ def google_callback():
 
 @app.route('/make_playlist', methods=['POST'])
 def make_playlist():
-    refresh_spotify_token()
-    refresh_google_token()
+    # Refresh only tokens that are actually expiring; the preflight below handles the rest locally
+    try:
+        refresh_spotify_token()
+    except Exception as e:
+        print(f"Spotify token refresh failed: {e}")
+        return jsonify({"status": "error", "message": token_check.MESSAGES[token_check.SPOTIFY_LOGIN]})
+    try:
+        refresh_google_token()
+    except Exception as e:
+        print(f"Google token refresh failed: {e}")
+        return jsonify({"status": "error", "message": token_check.MESSAGES[token_check.GOOGLE_LOGIN]})
+
+    preflight = token_check.check(session.get('uuid'), session.get('spotify_token_info'),
+                                  session.get('google_credentials'), session.get('calendar_timezone'))
+    if not preflight['ok']:
+        return jsonify({"status": "error", "message": preflight['message']})
+
+    # One playlist at a time per session: the session's cached clients aren't meant to be shared by two jobs.
+    # Async jobs can be called off, so clicking again replaces the running one (the new job starts once it's stopped)
+    running = jobs.get(session.get('job_id')) if session.get('job_id') else None
+    replaces = None
+    if running and running['status'] in ('queued', 'running'):
+        if jobs.EXECUTION_MODE != 'async':
+            return jsonify({"status": "success", "job_id": running['id']})
+        jobs.cancel(running['id'])
+        replaces = running['id']
+
+    # Jobs get the session id and read this session's tokens from the store by reference
+    token_store.update(session['uuid'], spotify_token_info=session['spotify_token_info'],
+                       google_credentials=session['google_credentials'], calendar_timezone=session['calendar_timezone'])
+    job_id = start_job(session['uuid'], after=replaces)
+    if job_id is None:
+        return jsonify({"status": "error", "message": "Lots of capsules being made right now! Give it a minute and try again."}), 503
+    session['job_id'] = job_id
+    return jsonify({"status": "success", "job_id": job_id})
+    
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job."}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    '''
+    Server-Sent Events stream of the job's stage transitions (import, selection, calendar, nlp, spotify_write, done),
+    each with its timings, so the loading screen doesn't have to poll /jobs/<job_id>.
+    '''
+    if jobs.get(job_id) is None:
+        return jsonify({"status": "error", "message": "Unknown job."}), 404
 
-    token_check_process = subprocess.Popen(['python', 'token_check.py'])
-    token_check_process.wait()
+    def stream():
+        for event in jobs.follow(job_id):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/health/firestore')
+def firestore_health():
+    return jsonify(firestore_client.get_stats())
 
-    if token_check_process.returncode == 0:
-        subprocess.Popen(['python', 'logic.py'])
-        return jsonify({"status": "success"})
-    
-    elif token_check_process.returncode == 1:
-        return jsonify({"status": "error", "message": "Log into Google again, and this should work just fine."})
-    
-    elif token_check_process.returncode == 2:
-        return jsonify({"status": "error", "message": "Log into Spotify again, then try this one more time."})
-    
-    elif token_check_process.returncode == 3:
-        return jsonify({"status": "error", "message": "This works best if you have more than 50 songs on your Spotify Liked Songs playlist. Take some time to discover new music, then come back here when the time is right."})
-    
 @app.route('/logout')
 def logout():
+    if session.get('uuid'):
+        clients.forget(session['uuid'])
+        token_check.forget(session['uuid'])
+        token_store.delete(session['uuid'])
     session.clear()
     return redirect(url_for('index'))
 
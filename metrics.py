@@ -0,0 +1,222 @@
+'''
+Lightweight in-process instrumentation for the generation pipeline, served in Prometheus text format at /metrics.
+
+Two kinds of timing are recorded:
+- span(stage): a pipeline stage (library sync, selection, calendar, nlp, spotify write, ...), as a latency histogram
+  plus an error counter.
+- external(upstream, call): one call to Spotify, Google Calendar, Firestore or OpenAI, as a call counter (by outcome)
+  plus a latency histogram.
+rate_limit.py adds gauges for its queues (callers waiting per upstream, current allowed rate) and throttle counters,
+and nlp.py counts description candidates by outcome, fallbacks and description cache hits.
+
+Each observation is a perf_counter() pair, a bisect into fixed buckets and one short lock, so this stays on in
+production. Nothing is exported until something scrapes /metrics.
+'''
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# HISTOGRAM BUCKETS (seconds): from in-memory selection up to a slow OpenAI round
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    'capsule_stage_seconds': 'Time spent in each stage of the playlist pipeline.',
+    'capsule_stage_errors_total': 'Pipeline stages that ended in an exception.',
+    'capsule_external_call_seconds': 'Latency of calls to external services.',
+    'capsule_external_calls_total': 'Calls to external services, by outcome (ok, throttled, error).',
+    'capsule_job_seconds': 'End-to-end time of playlist jobs, by final status.',
+    'capsule_rate_limit_waiting': 'Calls queued for a rate limiter token, per upstream.',
+    'capsule_rate_limit_rate': 'Requests per second each upstream rate limiter currently allows.',
+    'capsule_rate_limit_wait_seconds': 'Time calls spent queued for a rate limiter token.',
+    'capsule_rate_limit_throttled_total': 'Throttled responses (429 or rate limit errors) from each upstream.',
+    'capsule_nlp_candidates_total': 'Description candidates from OpenAI, by validation outcome (accepted, rejected).',
+    'capsule_nlp_fallbacks_total': 'Descriptions that fell back to the generic one after every round failed.',
+    'capsule_nlp_errors_total': 'Candidate requests to OpenAI that failed, were throttled throughout or timed out.',
+    'capsule_nlp_cache_lookups_total': 'Description cache lookups, by result (hit, miss).'
+}
+
+lock = threading.Lock()
+counters = {}    # (name, labels) -> value
+histograms = {}  # (name, labels) -> {'buckets': [count per bucket, +Inf last], 'sum', 'count'}
+gauges = {}      # (name, labels) -> value
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    key = (name, label_key(labels))
+    with lock:
+        counters[key] = counters.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    key = (name, label_key(labels))
+    with lock:
+        gauges[key] = value
+
+
+def observe(name, seconds, **labels):
+    key = (name, label_key(labels))
+    bucket = bisect_left(BUCKETS, seconds)
+    with lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+        histogram['buckets'][bucket] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+
+@contextmanager
+def span(stage):
+
+    '''
+    Times a pipeline stage: `with metrics.span('calendar'): ...`
+    '''
+
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        inc('capsule_stage_errors_total', stage=stage)
+        raise
+    finally:
+        observe('capsule_stage_seconds', time.perf_counter() - started, stage=stage)
+
+
+def http_status(e):
+
+    '''
+    The HTTP status behind a client library exception (spotipy's http_status, googleapiclient's resp.status,
+    openai's status_code), if any.
+    '''
+
+    status = (getattr(e, 'http_status', None) or getattr(getattr(e, 'resp', None), 'status', None)
+              or getattr(e, 'status_code', None))
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_throttled(e):
+
+    '''
+    Whether an exception is an upstream telling us to slow down: HTTP 429, or Google's 403 rateLimitExceeded /
+    userRateLimitExceeded.
+    '''
+
+    status = http_status(e)
+    if status == 429:
+        return True
+    content = getattr(e, 'content', None) or b''
+    return status == 403 and (b'rateLimitExceeded' in content or b'userRateLimitExceeded' in content)
+
+
+@contextmanager
+def external(upstream, call):
+
+    '''
+    Times and counts one external call: `with metrics.external('spotify', 'current_user'): sp.current_user()`
+
+    upstream (string): spotify, calendar, firestore or openai
+    call (string): the API method
+    '''
+
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except BaseException as e:
+        outcome = 'throttled' if is_throttled(e) else 'error'
+        raise
+    finally:
+        observe('capsule_external_call_seconds', time.perf_counter() - started, upstream=upstream, call=call)
+        inc('capsule_external_calls_total', upstream=upstream, call=call, outcome=outcome)
+
+
+def traced(stage):
+
+    '''
+    Decorator form of span(), for timing a whole function.
+    '''
+
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def reset():
+
+    '''
+    Clears everything recorded so far (benchmarks/pipeline_offline.py measures one run at a time).
+    '''
+
+    with lock:
+        counters.clear()
+        histograms.clear()
+        gauges.clear()
+
+
+# PROMETHEUS TEXT FORMAT
+def format_labels(labels, **extra):
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def render():
+
+    '''
+    Every counter and histogram in Prometheus text exposition format (version 0.0.4).
+    '''
+
+    with lock:
+        counter_items = sorted(counters.items())
+        gauge_items = sorted(gauges.items())
+        histogram_items = sorted((key, {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']})
+                                 for key, h in histograms.items())
+
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name not in seen:
+            seen.add(name)
+            if name in HELP:
+                lines.append(f'# HELP {name} {HELP[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+
+    for (name, labels), value in counter_items:
+        header(name, 'counter')
+        lines.append(f'{name}{format_labels(labels)} {value}')
+
+    for (name, labels), value in gauge_items:
+        header(name, 'gauge')
+        lines.append(f'{name}{format_labels(labels)} {value}')
+
+    for (name, labels), histogram in histogram_items:
+        header(name, 'histogram')
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), histogram['buckets']):
+            cumulative += count
+            lines.append(f'{name}_bucket{format_labels(labels, le=format_bound(bound))} {cumulative}')
+        lines.append(f'{name}_sum{format_labels(labels)} {histogram["sum"]}')
+        lines.append(f'{name}_count{format_labels(labels)} {histogram["count"]}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,73 @@
+'''
+One-shot migration: backfills the integer addedEpoch field (UTC epoch seconds) on every song imported
+before it existed, so ordering and range lookups no longer depend on comparing addedDate strings.
+Safe to re-run: songs that already have addedEpoch are skipped.
+
+This runs as its own process, so it can't touch a running server's in-memory song indexes. They don't need it:
+an index parses the same epoch from addedDate for songs without addedEpoch, so nothing changes for them.
+
+    python migrate_epochs.py             # every user collection
+    python migrate_epochs.py <username>  # just one
+    python migrate_epochs.py --dry-run
+'''
+
+import argparse
+
+from firestore_client import get_db
+from ingest import BATCH_SIZE
+from song_index import added_date_to_epoch
+
+
+def migrate_collection(db, collection_name, dry_run=False):
+
+    '''
+    Adds addedEpoch to every song in the collection missing it, in batched commits.
+    Returns (songs_updated, songs_skipped).
+    '''
+
+    updated = 0
+    skipped = 0
+    batch = db.batch()
+    pending = 0
+
+    for doc in db.collection(collection_name).select(['addedDate', 'addedEpoch']).stream():
+        song = doc.to_dict()
+        if song.get('addedEpoch') is not None or 'addedDate' not in song:
+            skipped += 1
+            continue
+
+        batch.update(doc.reference, {'addedEpoch': added_date_to_epoch(song['addedDate'])})
+        pending += 1
+        updated += 1
+
+        if pending == BATCH_SIZE:
+            if not dry_run:
+                batch.commit()
+            batch = db.batch()
+            pending = 0
+
+    if pending and not dry_run:
+        batch.commit()
+
+    return updated, skipped
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Backfill addedEpoch on existing song documents.')
+    arg_parser.add_argument('usernames', nargs='*', help='collections to migrate (default: all user collections)')
+    arg_parser.add_argument('--dry-run', action='store_true', help="count what would change, don't write")
+    args = arg_parser.parse_args()
+
+    # FIREBASE SETUP
+    db = get_db()
+
+    # Bookkeeping collections (_sync_state etc.) start with an underscore
+    usernames = args.usernames or [collection.id for collection in db.collections() if not collection.id.startswith('_')]
+
+    for username in usernames:
+        updated, skipped = migrate_collection(db, username, dry_run=args.dry_run)
+        print(f"{username}: {updated} songs {'would be ' if args.dry_run else ''}updated, {skipped} already had addedEpoch")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,12 @@
 import openai
 from dotenv import load_dotenv
 import os
+import time
+
+import description_cache
+import metrics
+import rate_limit
+from jobs import progress
 
 load_dotenv()
 
@@ -9,14 +15,22 @@ api_key = os.getenv("OPENAI_API_KEY")
 if api_key is None:
     raise ValueError("API key not found in .env file")
 openai.api_key = api_key
+openai.max_retries = 0  # rate limited requests are retried by rate_limit.py, against the shared OpenAI bucket
+
+# CANDIDATE GENERATION SETTINGS
+CANDIDATES_PER_REQUEST = 5   # completions requested at once via the `n` parameter
+MAX_ROUNDS = 4               # rounds of candidates before giving up (5 x 4 = 20, the old retry budget)
+DEADLINE_SECONDS = 20.0      # overall time budget for one description
+FALLBACK_DESCRIPTION = "...what moment do these songs bring you back to?"
 
 # GENERATE NLP FROM GCAL EVENT LIST
-def generate(input_string):
+@metrics.traced('nlp_generate')
+def generate_candidates(input_string, n=CANDIDATES_PER_REQUEST, timeout=None):
 
     '''
-    This is the main generative text function that links to the OpenAI API;
-    uses the model specified to generate a raw output sentence parsed from 
-    a comma-separated list of events originally taken from Google Calendar event data. 
+    Same prompt as generate(), but asks the OpenAI API for n completions in a single request.
+    Requests queue for the shared OpenAI rate limiter; timeout (seconds) bounds the queueing and any retries too.
+    Returns a list of raw output sentences (empty if the request failed, was throttled throughout or timed out).
     '''
 
     try:
@@ -28,27 +42,44 @@ def generate(input_string):
         max_char_length = 126
         max_tokens = max_char_length // 4  # Rough estimate
 
-        #3. GENERATE OUTPUT
-        response = openai.completions.create(
+        #3. GENERATE OUTPUTS
+        deadline = None if timeout is None else time.monotonic() + timeout
+        response = rate_limit.call(
+          'openai', 'completions.create', openai.completions.create,
           model="gpt-3.5-turbo-instruct",  # specify the model
           prompt=prompt,
-          max_tokens=max_tokens
+          max_tokens=max_tokens,
+          n=n,
+          timeout=timeout,
+          deadline=deadline
         )
-        output_text = response.choices[0].text.strip()
 
         #4. TRUNCATE IF NEEDED
-        if len(output_text) > max_char_length:
-            output_text = output_text[:max_char_length]
-
-        return output_text
+        return [choice.text.strip()[:max_char_length] for choice in response.choices]
 
     #5. CATCH ERRORS 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return None
+        metrics.inc('capsule_nlp_errors_total')
+        return []
+
+def generate(input_string):
+
+    '''
+    This is the main generative text function that links to the OpenAI API;
+    uses the model specified to generate a raw output sentence parsed from 
+    a comma-separated list of events originally taken from Google Calendar event data. 
+    '''
+
+    candidates = generate_candidates(input_string, n=1)
+    return candidates[0] if candidates else None
 
 def prepare(phrase):
 
+    # FAIL BASED ON MISSING OUTPUT (API ERROR)
+    if not phrase:
+        return ''
+
     # FAIL BASED ON INCOMPLETE SENTENCE
     if '.' in phrase:
         sentences = phrase.split('.', 1)
@@ -83,22 +114,44 @@ def prepare(phrase):
     # IF PASSED ALL, RETURN SENTENCE
     return sentence
     
-def process(input):
-
-    phrase = generate(input)
-    sentence = prepare(phrase)
-    attempts = 0
-    max_attempts = 20
-
-    for attempt in range(max_attempts):
-        attempts += 1
-        phrase = generate(input)
-        print(f"attempted phrase: {phrase}")
-        sentence = prepare(phrase)
-
-        if len(sentence) > 1:
-            return sentence 
-        
-    return "...what moment do these songs bring you back to?"
+def process(input, deadline=DEADLINE_SECONDS):
 
+    '''
+    Checks the description cache first. Otherwise requests rounds of candidate sentences, validates every one
+    with prepare(), caches the ones that pass and returns the first.
+    Falls back to a generic description once MAX_ROUNDS or the overall deadline (seconds) runs out.
+    '''
 
+    # SAME EVENTS SEEN BEFORE: REUSE A DESCRIPTION ALREADY WRITTEN FOR THEM
+    cached = description_cache.get(input)
+    if cached:
+        metrics.inc('capsule_nlp_cache_lookups_total', result='hit')
+        return cached
+    metrics.inc('capsule_nlp_cache_lookups_total', result='miss')
+
+    started = time.monotonic()
+
+    for attempt in range(MAX_ROUNDS):
+        remaining = deadline - (time.monotonic() - started)
+        if remaining <= 0:
+            break
+
+        accepted = []
+        for phrase in generate_candidates(input, timeout=remaining):
+            print(f"attempted phrase: {phrase}")
+            sentence = prepare(phrase)
+            if len(sentence) > 1:
+                metrics.inc('capsule_nlp_candidates_total', outcome='accepted')
+                accepted.append(sentence)
+            else:
+                metrics.inc('capsule_nlp_candidates_total', outcome='rejected')
+
+        progress('nlp_attempt', round=attempt + 1, accepted=len(accepted))
+
+        if accepted:
+            # Keep every validated sentence so a repeat hit can read differently
+            description_cache.add(input, accepted)
+            return accepted[0]
+
+    metrics.inc('capsule_nlp_fallbacks_total')
+    return FALLBACK_DESCRIPTION
@@ -0,0 +1,243 @@
+'''
+Shared per-upstream rate limiting for Spotify, Google Calendar and OpenAI.
+
+Every call to a limited upstream takes a token from that upstream's bucket first. All jobs in this process share
+the buckets, so concurrent users queue for the app's quota rather than each hitting it on their own. When an
+upstream throttles anyway (HTTP 429, or Google's 403 rateLimitExceeded):
+- everyone waiting on that upstream holds off for the Retry-After it sent (plus jitter), or a jittered exponential
+  backoff if it didn't send one
+- the bucket's rate is halved, then creeps back up to the configured rate with every call that goes through
+- the throttled call is retried, up to MAX_RETRIES times
+That keeps throughput near the quota ceiling instead of collapsing into a storm of retries.
+
+Queue depth, current rate, time spent queued and throttle counts are exported on /metrics (and via get_stats()).
+Rates are per process: with several app processes, divide the upstream's quota between them.
+
+Async jobs (async_pipeline.py) wait for their token on the event loop with acquire_async() and hand it to the call
+they then run on a thread (see prepaid), so queueing for a busy upstream doesn't hold a thread.
+'''
+
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+
+import metrics
+
+# REQUESTS PER SECOND AND BURST SIZE PER UPSTREAM
+LIMITS = {
+    'spotify': (float(os.getenv('CAPSULE_SPOTIFY_RPS', '20')), int(os.getenv('CAPSULE_SPOTIFY_BURST', '40'))),
+    'calendar': (float(os.getenv('CAPSULE_CALENDAR_RPS', '10')), int(os.getenv('CAPSULE_CALENDAR_BURST', '20'))),
+    'openai': (float(os.getenv('CAPSULE_OPENAI_RPS', '10')), int(os.getenv('CAPSULE_OPENAI_BURST', '20')))
+}
+for upstream, (rate, burst) in LIMITS.items():
+    if not rate > 0 or burst < 1:  # `not rate > 0` also catches nan
+        raise ValueError(f"{upstream} rate limit needs RPS > 0 and BURST >= 1 (got {rate}, {burst})")
+
+# BACKOFF SETTINGS
+MAX_RETRIES = 5
+BASE_BACKOFF = 1.0         # seconds, doubled per attempt when the upstream sends no Retry-After
+MAX_BACKOFF = 32.0
+RETRY_AFTER_JITTER = 0.2   # wait up to 20% past Retry-After, so queued callers don't all fire at once
+MIN_RATE_FRACTION = 0.1    # never slow down below 10% of the configured rate
+RECOVERY_FRACTION = 0.02   # each call that goes through gives back 2% of the configured rate
+
+
+def retry_after(e):
+
+    '''
+    Seconds a throttled upstream asked us to wait (its Retry-After header), or None if it didn't say.
+    '''
+
+    headers = (getattr(e, 'headers', None)                                 # spotipy
+               or getattr(e, 'resp', None)                                 # googleapiclient (httplib2 header dict)
+               or getattr(getattr(e, 'response', None), 'headers', None)   # openai
+               or {})
+    value = headers.get('Retry-After') or headers.get('retry-after')
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class Bucket:
+
+    '''
+    Token bucket for one upstream, whose refill rate adapts to throttling.
+    '''
+
+    def __init__(self, upstream, rate, burst):
+        self.upstream = upstream
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.waiting = 0
+        self.throttles = 0
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def queued(self, change):
+        with self.lock:
+            self.waiting += change
+            metrics.set_gauge('capsule_rate_limit_waiting', self.waiting, upstream=self.upstream)
+
+    def take(self, cost, deadline):
+
+        '''
+        Takes cost tokens if they're available now and returns 0, else returns how long to wait before trying again.
+        Raises RuntimeError if that wait would take past deadline (a time.monotonic() value).
+        '''
+
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            if now >= self.blocked_until and self.tokens >= cost:
+                self.tokens -= cost
+                return 0.0
+            wait = max(self.blocked_until - now, (cost - self.tokens) / self.rate)
+        if deadline is not None and now + wait > deadline:
+            raise RuntimeError(f"Timed out waiting for the {self.upstream} rate limit")
+        return wait
+
+    def acquire(self, cost=1, deadline=None):
+
+        '''
+        Blocks until cost tokens are available and takes them.
+        Raises RuntimeError if that would take past deadline (a time.monotonic() value).
+        '''
+
+        cost = min(cost, self.burst)
+        started = time.monotonic()
+        self.queued(1)
+        try:
+            wait = self.take(cost, deadline)
+            while wait > 0:
+                time.sleep(wait)
+                wait = self.take(cost, deadline)
+        finally:
+            self.queued(-1)
+        metrics.observe('capsule_rate_limit_wait_seconds', time.monotonic() - started, upstream=self.upstream)
+
+    async def acquire_async(self, cost=1, deadline=None):
+
+        '''
+        acquire(), waiting on the event loop instead of blocking a thread.
+        '''
+
+        cost = min(cost, self.burst)
+        started = time.monotonic()
+        self.queued(1)
+        try:
+            wait = self.take(cost, deadline)
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self.take(cost, deadline)
+        finally:
+            self.queued(-1)
+        metrics.observe('capsule_rate_limit_wait_seconds', time.monotonic() - started, upstream=self.upstream)
+
+    def throttled(self, e, attempt):
+
+        '''
+        Records a throttled response: holds every caller off and halves the rate. Returns the wait in seconds.
+        '''
+
+        suggested = retry_after(e)
+        if suggested is None:
+            cap = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt)
+            wait = cap / 2 + random.uniform(0, cap / 2)
+        else:
+            wait = suggested * (1 + random.uniform(0, RETRY_AFTER_JITTER))
+
+        with self.lock:
+            now = time.monotonic()
+            # Calls already in flight come back throttled together; only the first of them slows the bucket down
+            if now >= self.blocked_until:
+                self.rate = max(self.max_rate * MIN_RATE_FRACTION, self.rate / 2)
+            self.blocked_until = max(self.blocked_until, now + wait)
+            self.tokens = 0.0
+            self.updated = self.blocked_until  # nothing accrues while we're held off
+            self.throttles += 1
+            rate, wait = self.rate, self.blocked_until - now
+        metrics.inc('capsule_rate_limit_throttled_total', upstream=self.upstream)
+        metrics.set_gauge('capsule_rate_limit_rate', rate, upstream=self.upstream)
+        return wait
+
+    def succeeded(self):
+        with self.lock:
+            if self.rate >= self.max_rate:
+                return
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY_FRACTION)
+            rate = self.rate
+        metrics.set_gauge('capsule_rate_limit_rate', rate, upstream=self.upstream)
+
+
+buckets = {upstream: Bucket(upstream, rate, burst) for upstream, (rate, burst) in LIMITS.items()}
+
+# TOKENS ALREADY TAKEN ON THE EVENT LOOP: upstream -> count, spent by the next call()s in this context
+prepaid = contextvars.ContextVar('rate_limit_prepaid', default=None)
+
+
+def spend_prepaid(upstream, cost):
+
+    '''
+    Uses up to cost prepaid tokens for upstream. Returns how many tokens still have to be acquired.
+    '''
+
+    paid = prepaid.get()
+    if not paid or not paid.get(upstream):
+        return cost
+    spent = min(cost, paid[upstream])
+    paid[upstream] -= spent
+    return cost - spent
+
+
+def call(upstream, call_name, fn, *args, cost=1, deadline=None, **kwargs):
+
+    '''
+    Runs fn(*args, **kwargs) once upstream's bucket allows it, retrying when the upstream throttles it.
+
+    upstream (string): spotify, calendar or openai
+    call_name (string): the API method, for /metrics
+    cost (int): tokens the call uses (a batch of n requests counts n)
+    deadline (float): time.monotonic() value past which we stop queueing and retrying
+
+    Raises the upstream's error if it's not a throttle, or once MAX_RETRIES retries (or the deadline) run out.
+    '''
+
+    bucket = buckets[upstream]
+    for attempt in range(MAX_RETRIES + 1):
+        remaining = spend_prepaid(upstream, cost) if attempt == 0 else cost
+        if remaining:
+            bucket.acquire(remaining, deadline)
+        try:
+            with metrics.external(upstream, call_name):
+                result = fn(*args, **kwargs)
+        except Exception as e:
+            if not metrics.is_throttled(e):
+                raise
+            wait = bucket.throttled(e, attempt)
+            if attempt == MAX_RETRIES or (deadline is not None and time.monotonic() + wait > deadline):
+                raise
+            print(f"{upstream} throttled {call_name}, retrying in {wait:.1f}s")
+            continue
+        bucket.succeeded()
+        return result
+
+
+def get_stats():
+    stats = {}
+    for upstream, bucket in buckets.items():
+        with bucket.lock:
+            stats[upstream] = {'waiting': bucket.waiting, 'rate': bucket.rate, 'max_rate': bucket.max_rate,
+                               'throttles': bucket.throttles}
+    return stats
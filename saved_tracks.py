@@ -0,0 +1,73 @@
+'''
+Concurrent pager for the user's Spotify Liked Songs.
+
+The first page tells us the library's total size, so every remaining offset is known up front and the
+rest of the pages can be requested in parallel on a small worker pool. Pages are yielded in offset order
+while at most MAX_IN_FLIGHT requests run ahead of the caller, so memory stays flat however big the library
+is, the caller can ingest while later pages download, and "everything before offset N is done" is a usable
+checkpoint. Requests go through the shared Spotify rate limiter (rate_limit.py), which also retries them when
+Spotify answers 429.
+'''
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import rate_limit
+
+PAGE_SIZE = 50  # max page size for current_user_saved_tracks
+MAX_WORKERS = 4
+MAX_IN_FLIGHT = 2 * MAX_WORKERS  # pages requested ahead of the caller (the bound on buffered pages)
+
+
+def fetch_page(sp, offset, page_size=PAGE_SIZE):
+
+    '''
+    One current_user_saved_tracks page, rate limited and retried on 429.
+    '''
+
+    return rate_limit.call('spotify', 'current_user_saved_tracks', sp.current_user_saved_tracks,
+                           limit=page_size, offset=offset)
+
+
+def fetch_saved_track_pages(sp, limit=None, start=0, page_size=PAGE_SIZE, max_workers=MAX_WORKERS,
+                            max_in_flight=MAX_IN_FLIGHT):
+
+    '''
+    Yields (offset, results) for every saved-tracks page from `start` on, in offset order (newest songs first).
+
+    sp (Spotify): spotipy client
+    limit (int): stop at this many tracks from the top of the library (None = whole library)
+    start (int): offset to begin at, e.g. an import checkpoint
+    page_size (int): tracks per request, at most 50
+    max_workers (int): concurrent page requests
+    max_in_flight (int): pages requested ahead of the caller; bounds how many are held in memory at once
+    '''
+
+    total = None if limit is None else limit
+    if total is not None and start >= total:
+        return
+
+    #1. FIRST PAGE SERIALLY: IT CARRIES THE LIBRARY TOTAL
+    first = fetch_page(sp, start, page_size if total is None else min(page_size, total - start))
+    yield start, first
+
+    total = first['total'] if total is None else min(first['total'], total)
+    offsets = iter(range(start + page_size, total, page_size))
+
+    #2. REST OF THE PAGES CONCURRENTLY, A BOUNDED WINDOW AHEAD OF THE CALLER, YIELDED IN ORDER
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='spotify-pages')
+    try:
+        def request(offset):
+            return offset, executor.submit(fetch_page, sp, offset, min(page_size, total - offset))
+
+        in_flight = deque(request(offset) for _, offset in zip(range(max_in_flight), offsets))
+        while in_flight:
+            offset, future = in_flight.popleft()
+            results = future.result()
+            next_offset = next(offsets, None)
+            if next_offset is not None:
+                in_flight.append(request(next_offset))
+            yield offset, results
+    finally:
+        # If the caller stops early (or a page fails), don't leave requests queued
+        executor.shutdown(wait=False, cancel_futures=True)
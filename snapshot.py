@@ -0,0 +1,242 @@
+'''
+Compact on-disk snapshot of a user's library, one memory-mappable file per user under .library_snapshots/.
+
+Firestore stays the source of truth. The snapshot is a columnar copy of the user's songs, sorted by the date
+they were liked:
+- epochs: int64 UTC epoch seconds
+- offsets: int16 UTC offset in minutes that addedDate was written with (addedDate is rebuilt from it on demand)
+- codes: int32 index of each song's track id in the dictionary
+- dictionary: the distinct 22-character base62 track ids, 22 bytes each (not full spotify:track: URIs)
+- extras: the odd URI that isn't a plain track (local files etc.), stored whole as JSON; codes past the
+          dictionary point into it
+
+Every snapshot carries the version of the sync state it was built from (see sync.state_version), and load()
+only hands it out while that's still the current version. Loading maps the file and reads the columns in place
+through memoryviews, so a job or a new process gets the library without reading Firestore or copying it.
+'''
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from ingest import song_doc_id
+from timezone import format_offset
+
+SNAPSHOT_DIR = '.library_snapshots'
+MAGIC = b'CAPSNAP1'
+HEADER = struct.Struct('<8sIQQQ')  # magic, version length, song count, dictionary size, extras length (little-endian)
+TRACK_PREFIX = 'spotify:track:'
+TRACK_ID_LENGTH = 22
+
+
+def path_for(username):
+    return os.path.join(SNAPSHOT_DIR, hashlib.sha1(username.encode('utf-8')).hexdigest() + '.snap')
+
+
+def aligned(position):
+    return (position + 7) // 8 * 8
+
+
+def local_offset_minutes(added_date, added_epoch):
+
+    '''
+    The UTC offset (minutes) an addedDate string was written with, given the instant it stands for.
+    '''
+
+    local_as_utc = datetime.fromisoformat(added_date[:19]).replace(tzinfo=dt_timezone.utc).timestamp()
+    return int(local_as_utc - added_epoch) // 60
+
+
+class AddedDates:
+
+    '''
+    Read-only sequence of addedDate strings, rebuilt from the epoch and offset columns when asked for.
+    '''
+
+    def __init__(self, epochs, offsets):
+        self.epochs = epochs
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        offset = timedelta(minutes=self.offsets[i])
+        local = datetime.fromtimestamp(self.epochs[i], dt_timezone.utc) + offset
+        return local.strftime('%Y-%m-%dT%H:%M:%S') + format_offset(offset)
+
+
+class TrackURIs:
+
+    '''
+    Read-only sequence of track URIs, decoded from the dictionary when asked for.
+    '''
+
+    def __init__(self, codes, dictionary, extras):
+        self.codes = codes
+        self.dictionary = dictionary
+        self.extras = extras
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self.uri(self.codes[i])
+
+    def uri(self, code):
+        dictionary_size = len(self.dictionary) // TRACK_ID_LENGTH
+        if code >= dictionary_size:
+            return self.extras[code - dictionary_size]
+        start = code * TRACK_ID_LENGTH
+        return TRACK_PREFIX + bytes(self.dictionary[start:start + TRACK_ID_LENGTH]).decode('ascii')
+
+    def track_ids(self):
+
+        '''
+        Every distinct track id (what ingest.song_doc_id uses as the document id for plain tracks).
+        '''
+
+        data = bytes(self.dictionary)
+        return [data[start:start + TRACK_ID_LENGTH].decode('ascii') for start in range(0, len(data), TRACK_ID_LENGTH)]
+
+
+def track_id_of(uri):
+    track_id = uri[len(TRACK_PREFIX):] if uri.startswith(TRACK_PREFIX) else ''
+    return track_id if len(track_id) == TRACK_ID_LENGTH and track_id.isascii() else None
+
+
+def encode(index):
+
+    '''
+    Column arrays for a song index ({'epochs', 'dates', 'uris'}, sorted by epoch).
+    Returns (epochs, offsets, codes, dictionary bytes, extras list).
+    '''
+
+    epochs = array('q', index['epochs'])
+    offsets = array('h', (local_offset_minutes(date, epoch) for date, epoch in zip(index['dates'], epochs)))
+
+    #1. DICTIONARY OF DISTINCT TRACK IDS, IN FIRST-SEEN ORDER
+    track_ids = [track_id_of(uri) for uri in index['uris']]
+    track_codes = {}
+    for track_id in track_ids:
+        if track_id is not None and track_id not in track_codes:
+            track_codes[track_id] = len(track_codes)
+
+    #2. ONE CODE PER SONG; ANYTHING THAT ISN'T A PLAIN TRACK GETS A CODE PAST THE DICTIONARY
+    extras = [uri for uri, track_id in zip(index['uris'], track_ids) if track_id is None]
+    codes = array('i')
+    next_extra = len(track_codes)
+    for track_id in track_ids:
+        if track_id is None:
+            codes.append(next_extra)
+            next_extra += 1
+        else:
+            codes.append(track_codes[track_id])
+
+    return epochs, offsets, codes, ''.join(track_codes).encode('ascii'), extras
+
+
+def write(username, version, index):
+
+    '''
+    Writes the user's snapshot for the given sync state version, replacing any older one atomically.
+    '''
+
+    epochs, offsets, codes, dictionary, extras = encode(index)
+    if sys.byteorder != 'little':
+        for column in (epochs, offsets, codes):
+            column.byteswap()
+
+    version_bytes = version.encode('utf-8')
+    extras_bytes = json.dumps(extras).encode('utf-8')
+
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = path_for(username)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as outfile:
+        outfile.write(HEADER.pack(MAGIC, len(version_bytes), len(epochs), len(dictionary) // TRACK_ID_LENGTH,
+                                  len(extras_bytes)))
+        outfile.write(version_bytes)
+        for section in (epochs.tobytes(), offsets.tobytes(), codes.tobytes(), dictionary, extras_bytes):
+            outfile.write(b'\0' * (aligned(outfile.tell()) - outfile.tell()))
+            outfile.write(section)
+    os.replace(temp_path, path)
+
+
+def load(username, version):
+
+    '''
+    The user's snapshot as a song index ({'epochs', 'dates', 'uris', 'version'}) read in place from the mapped
+    file, or None if there's no snapshot for this sync state version.
+
+    epochs is a memoryview of int64s; dates and uris are sequences decoded on access (slices come back as lists).
+    '''
+
+    if sys.byteorder != 'little':  # the columns are cast in place, so only little-endian hosts can read them
+        return None
+
+    try:
+        with open(path_for(username), 'rb') as infile:
+            mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):  # ValueError: empty file
+        return None
+
+    view = memoryview(mapped)
+    if len(view) < HEADER.size:
+        return None
+    magic, version_length, count, dictionary_size, extras_length = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        return None
+
+    position = HEADER.size
+    if bytes(view[position:position + version_length]).decode('utf-8') != version:
+        return None
+    position += version_length
+
+    def section(length):
+        nonlocal position
+        start = aligned(position)
+        position = start + length
+        if position > len(view):
+            raise ValueError('truncated snapshot')
+        return view[start:position]
+
+    try:
+        epochs = section(count * 8).cast('q')
+        offsets = section(count * 2).cast('h')
+        codes = section(count * 4).cast('i')
+        dictionary = section(dictionary_size * TRACK_ID_LENGTH)
+        extras = json.loads(bytes(section(extras_length)).decode('utf-8'))
+    except ValueError:
+        print(f"Ignoring unreadable library snapshot for '{username}'")
+        return None
+
+    return {
+        'epochs': epochs,
+        'dates': AddedDates(epochs, offsets),
+        'uris': TrackURIs(codes, dictionary, extras),
+        'version': version
+    }
+
+
+def doc_ids(username, version):
+
+    '''
+    Firestore document ids of every song in the snapshot (for diffing against Spotify during a sync),
+    or None if there's no snapshot for this version.
+    '''
+
+    index = load(username, version)
+    if index is None:
+        return None
+    uris = index['uris']
+    return uris.track_ids() + [song_doc_id(uri) for uri in uris.extras]
@@ -0,0 +1,128 @@
+'''
+In-memory, per-user index of a library's songs sorted by the date they were liked.
+
+The whole collection is read once (one streamed query) into a sorted int64 array of UTC epoch seconds with
+the matching addedDate strings and track URIs alongside it. Taking a playlist window is then a slice instead
+of two ordered Firestore range queries per attempt. Indexes are cached across jobs and
+dropped by sync.py whenever a sync actually changes the library.
+
+Given the library version sync.py reports, an index is also written out as a compact snapshot (snapshot.py),
+so the next process, or the next job after the in-memory copy was evicted, maps it from disk instead of
+reading Firestore again.
+'''
+
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import metrics
+import snapshot
+
+MAX_CACHED_USERS = 64
+
+index_cache = OrderedDict()
+index_cache_lock = threading.Lock()
+
+
+def added_date_to_epoch(date_str):
+
+    '''
+    UTC epoch seconds for a stored addedDate string.
+
+    date_str (string): local datetime plus offset, e.g. "2022-09-13T19:11:26-05:00". Also accepts the
+                       unpadded/unsigned offsets older imports wrote ("-5:00", "05:00").
+    '''
+
+    local_dt = datetime.fromisoformat(date_str[:19])
+    offset = date_str[19:]
+    if offset in ('', 'Z'):
+        offset_delta = timedelta(0)
+    else:
+        sign = -1 if offset.startswith('-') else 1
+        hours, minutes = offset.lstrip('+-').split(':')
+        offset_delta = sign * timedelta(hours=int(hours), minutes=int(minutes))
+    return int((local_dt - offset_delta).replace(tzinfo=timezone.utc).timestamp())
+
+
+def load_song_index(db, username):
+
+    '''
+    Reads db.collection(username) once and returns its index: {'epochs', 'dates', 'uris'}, sorted by epoch.
+    '''
+
+    rows = []
+    with metrics.external('firestore', 'songs.stream'):
+        docs = list(db.collection(username).select(['addedDate', 'addedEpoch', 'trackURI']).stream())
+    for doc in docs:
+        song = doc.to_dict()
+        # Songs written before addedEpoch existed get it parsed from the string (migrate_epochs.py backfills them)
+        added_epoch = song.get('addedEpoch')
+        if added_epoch is None:
+            added_epoch = added_date_to_epoch(song['addedDate'])
+        rows.append((added_epoch, song['addedDate'], song['trackURI']))
+    rows.sort()
+
+    return {
+        'epochs': array('q', [row[0] for row in rows]),
+        'dates': [row[1] for row in rows],
+        'uris': [row[2] for row in rows]
+    }
+
+
+def get_song_index(db, username, version=None):
+
+    '''
+    Cached load_song_index: the first job for a user reads Firestore, later jobs reuse it until invalidated.
+
+    version (string): the library version from sync.sync_library; when given, a cached index from another version
+                      isn't used, and the on-disk snapshot is tried before Firestore (and written after a read)
+    '''
+
+    with index_cache_lock:
+        index = index_cache.get(username)
+        if index is not None and (version is None or index.get('version') == version):
+            index_cache.move_to_end(username)
+            return index
+
+    index = snapshot.load(username, version) if version else None
+    if index is None:
+        index = load_song_index(db, username)
+        if version:
+            index['version'] = version
+            try:
+                snapshot.write(username, version, index)
+                index = snapshot.load(username, version) or index
+            except (OSError, ValueError) as e:
+                print(f"Couldn't write library snapshot for '{username}': {e}")
+
+    with index_cache_lock:
+        index_cache[username] = index
+        index_cache.move_to_end(username)
+        while len(index_cache) > MAX_CACHED_USERS:
+            index_cache.popitem(last=False)
+    return index
+
+
+def invalidate_song_index(username):
+    with index_cache_lock:
+        index_cache.pop(username, None)
+
+
+def window_at(index, first, playlist_length):
+
+    '''
+    The window of (up to) playlist_length songs starting at position first, e.g. one picked by window_scoring.
+
+    Returns (next_songs, playlistStart, playlistEnd, tracks); the bookends are UTC epoch seconds.
+    '''
+
+    epochs = index['epochs']
+    last = min(first + playlist_length, len(epochs))
+    if first >= last:
+        return [], None, None, []
+
+    tracks = index['uris'][first:last]
+    next_songs = [{'addedDate': date, 'addedEpoch': epoch, 'trackURI': uri}
+                  for date, epoch, uri in zip(index['dates'][first:last], epochs[first:last], tracks)]
+    return next_songs, epochs[first], epochs[last - 1], tracks
@@ -0,0 +1,57 @@
+'''
+Writes a finished capsule to the user's Spotify account in as few round trips as possible.
+
+The playlist is created with its description in the same request (no follow-up change_details call), tracks are
+added in chunks of 100 (the most playlist_add_items takes per request), and the user id comes from the profile
+the job already fetched instead of another current_user() call. Every call's latency is recorded (and goes to
+the /metrics external call histograms through rate_limit.call).
+'''
+
+import time
+
+import rate_limit
+
+MAX_TRACKS_PER_REQUEST = 100
+
+
+def timed(call_name, calls, fn, *args, **kwargs):
+
+    '''
+    Runs one Spotify call through the shared rate limiter, appending (call_name, milliseconds) to calls (the call
+    itself lands in the /metrics histograms). Time spent queued or backing off counts too.
+    '''
+
+    started = time.perf_counter()
+    try:
+        return rate_limit.call('spotify', call_name, fn, *args, **kwargs)
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        calls.append((call_name, elapsed_ms))
+
+
+def write_playlist(sp, user_id, track_uris, title, description):
+
+    '''
+    Create a Spotify playlist (title + description in one request) and add tracks to it.
+
+    sp (Spotify): The Spotify client object.
+    user_id (str): Spotify user id, from the profile fetched once per job.
+    track_uris (list): A list of track URIs to add to the playlist.
+    title (str): The title of the playlist.
+    description (str): The description of the playlist.
+
+    Returns (playlist_id, calls) where calls is a list of (call name, milliseconds).
+    '''
+
+    calls = []
+
+    #1. CREATE THE PLAYLIST WITH ITS DESCRIPTION
+    playlist = timed('user_playlist_create', calls, sp.user_playlist_create, user_id, title, public=True, description=description)
+    playlist_id = playlist['id']
+
+    #2. ADD TRACKS, 100 PER REQUEST
+    for start in range(0, len(track_uris), MAX_TRACKS_PER_REQUEST):
+        timed('playlist_add_items', calls, sp.playlist_add_items, playlist_id, track_uris[start:start + MAX_TRACKS_PER_REQUEST])
+
+    print("Spotify write: " + ', '.join(f"{call_name} {elapsed_ms:.0f}ms" for call_name, elapsed_ms in calls))
+    return playlist_id, calls
@@ -0,0 +1,286 @@
+'''
+Incremental sync of a user's Liked Songs into their Firestore collection.
+
+Each user has a high-water mark in the _sync_state collection: the newest Spotify added_at we've imported
+and the size of their Spotify library at that point. Saved tracks come back newest first, so a returning
+user only needs the pages up to the first track at or before the mark (usually a single request).
+Removals are caught by comparing counts: if the library shrank by more than what we just added,
+we do one full reconcile and delete the songs that are no longer liked.
+
+A first import streams the whole library (or the newest CAPSULE_IMPORT_LIMIT songs): pages come in a bounded
+window ahead of the writer and go out in 500-write commits, so memory doesn't grow with the library. After
+every commit the import records how far it got in the same _sync_state document, and an interrupted import
+picks up from there on the next run instead of starting over. The checkpoint's cursor is the added_at of the last
+song committed, not just its offset: songs liked or unliked in between shift every offset, so a resume re-seeks
+to the cursor, and then reconciles away anything removed from the part already imported.
+'''
+
+import os
+from collections import deque
+
+from firebase_admin import firestore
+
+from ingest import delete_songs_batched, song_doc_id, write_songs_batched
+from saved_tracks import PAGE_SIZE, fetch_page, fetch_saved_track_pages
+from song_index import invalidate_song_index
+import metrics
+import snapshot
+
+STATE_COLLECTION = '_sync_state'
+IMPORT_LIMIT = int(os.getenv('CAPSULE_IMPORT_LIMIT', '0')) or None  # newest songs a first import pulls in; 0 = all
+
+
+def load_state(db, username):
+    with metrics.external('firestore', 'sync_state.get'):
+        document = db.collection(STATE_COLLECTION).document(username).get()
+    return document.to_dict() if document.exists else None
+
+
+def save_state(db, username, latest_added_at, track_count):
+    with metrics.external('firestore', 'sync_state.set'):
+        db.collection(STATE_COLLECTION).document(username).set({
+            'latestAddedAt': latest_added_at,
+            'trackCount': track_count,
+            'syncedAt': firestore.SERVER_TIMESTAMP
+        })
+
+
+def state_version(state):
+
+    '''
+    Identifies the library as of a sync state: changes whenever a sync adds (newer high-water mark) or removes
+    (different track count) songs. None for a missing or unfinished state. snapshot.py files are keyed on it.
+    '''
+
+    if not state or 'latestAddedAt' not in state:
+        return None
+    return f"{state['latestAddedAt']}|{state['trackCount']}"
+
+
+def save_checkpoint(db, username, offset, cursor, latest_added_at, track_count, legacy):
+
+    '''
+    Records an unfinished first import: every song liked after `cursor` (a Spotify added_at), which was everything
+    before `offset` (newest first) at the time, is stored.
+    save_state() overwrites the document once the import completes, which clears this.
+    '''
+
+    with metrics.external('firestore', 'sync_state.set'):
+        db.collection(STATE_COLLECTION).document(username).set({
+            'importOffset': offset,
+            'importCursor': cursor,
+            'importLatestAddedAt': latest_added_at,
+            'importTrackCount': track_count,
+            'importLegacy': legacy,
+            'syncedAt': firestore.SERVER_TIMESTAMP
+        })
+
+
+def collection_exists(db, collection_name):
+    return any(db.collection(collection_name).limit(1).get())
+
+
+def fetch_new_items(sp, latest_added_at):
+
+    '''
+    Walks saved tracks newest first and stops at the first one at or before the high-water mark.
+
+    latest_added_at (string): Spotify added_at of the newest song already imported ("2022-09-13T19:11:26Z",
+                              which sorts correctly as a string)
+
+    Returns (new_items, library_total, requests_made).
+    '''
+
+    new_items = []
+    offset = 0
+    requests_made = 0
+    while True:
+        results = fetch_page(sp, offset)
+        requests_made += 1
+
+        for item in results['items']:
+            if item['added_at'] <= latest_added_at:
+                return new_items, results['total'], requests_made
+            new_items.append(item)
+
+        if len(results['items']) < PAGE_SIZE:
+            return new_items, results['total'], requests_made
+        offset += PAGE_SIZE
+
+
+def seek_cursor(sp, cursor, offset):
+
+    '''
+    Finds where an interrupted import continues once the library may have shifted under it.
+
+    cursor (string): added_at of the last song the import committed
+    offset (int): where that song's successor was when the checkpoint was written (the first guess)
+
+    Returns (start, requests_made): an offset at or before the first song liked at or before cursor. Pages from
+    there on still hold a few songs newer than cursor, which the import skips.
+    '''
+
+    requests_made = 0
+    start = offset
+    while start > 0:
+        # Step back a page until the song at `start` is newer than the cursor (removals above it shift songs up)
+        probe = max(0, start - PAGE_SIZE)
+        results = fetch_page(sp, probe, 1)
+        requests_made += 1
+        if probe == 0 or (results['items'] and results['items'][0]['added_at'] > cursor):
+            return probe, requests_made  # (an empty page means the library shrank below probe: keep stepping)
+        start = probe
+    return 0, requests_made
+
+
+def reconcile(db, sp, username, keep_ids=None, stored_ids=None):
+
+    '''
+    Deletes stored songs that are no longer in the user's Liked Songs.
+
+    keep_ids (set): document ids known to be current; if None, the whole library is re-read to find them.
+    stored_ids (list): document ids in the collection (e.g. from the library snapshot); if None, they're listed
+                       from Firestore.
+
+    Returns (removed_count, requests_made).
+    '''
+
+    requests_made = 0
+    if keep_ids is None:
+        keep_ids = set()
+        for offset, results in fetch_saved_track_pages(sp):
+            requests_made += 1
+            keep_ids.update(song_doc_id(item['track']['uri']) for item in results['items'])
+
+    if stored_ids is None:
+        stored_ids = [doc_ref.id for doc_ref in db.collection(username).list_documents()]
+    removed = delete_songs_batched(db, username, [doc_id for doc_id in stored_ids if doc_id not in keep_ids])
+    return removed, requests_made
+
+
+def full_import(db, sp, username, to_songs, limit, checkpoint=None, legacy=False):
+
+    '''
+    Imports the newest `limit` liked songs (None = all of them), resuming from checkpoint (the sync state of an
+    interrupted import) if given.
+
+    legacy (bool): the collection predates sync state, so the ids written are collected for reconcile()
+
+    Returns (stats, latest_added_at, library_total, imported_ids, requests_made); imported_ids is None unless
+    legacy, and also when resuming, since the ids written before the interruption are gone.
+    '''
+
+    start = checkpoint['importOffset'] if checkpoint else 0
+    cursor = checkpoint.get('importCursor') if checkpoint else None  # checkpoints from before cursors: offset only
+    latest = {
+        'added_at': checkpoint['importLatestAddedAt'] if checkpoint else '',
+        'total': checkpoint['importTrackCount'] if checkpoint else 0,
+        'requests': 0
+    }
+    imported_ids = set() if legacy and not checkpoint else None
+
+    if cursor:
+        start, latest['requests'] = seek_cursor(sp, cursor, start)
+
+    pending = deque()  # (added_at, offset) of every song handed to the writer and not yet committed
+    committed = {'count': 0, 'offset': start, 'cursor': cursor}
+
+    def songs():
+        # Pages arrive in order from a bounded window of concurrent requests, so writes start before the last page lands
+        for offset, results in fetch_saved_track_pages(sp, limit=limit, start=start):
+            latest['requests'] += 1
+            latest['total'] = results['total']
+            items = []
+            for position, item in enumerate(results['items'], offset):
+                if cursor and item['added_at'] > cursor:
+                    continue  # committed before the interruption (or liked since; the next sync picks those up)
+                latest['added_at'] = max(latest['added_at'], item['added_at'])
+                if imported_ids is not None:
+                    imported_ids.add(song_doc_id(item['track']['uri']))
+                pending.append((item['added_at'], position))
+                items.append(item)
+            yield from to_songs(items)
+
+    def save_progress(songs_written):
+        # Songs are written in library order, so the first songs_written handed over are committed
+        while committed['count'] < songs_written:
+            committed['cursor'], position = pending.popleft()
+            committed['offset'] = position + 1
+            committed['count'] += 1
+        save_checkpoint(db, username, committed['offset'], committed['cursor'], latest['added_at'], latest['total'],
+                        legacy)
+
+    stats = write_songs_batched(db, username, songs(), on_commit=save_progress)
+    return stats, latest['added_at'], latest['total'], imported_ids, latest['requests']
+
+
+def sync_library(db, sp, username, to_songs, limit=IMPORT_LIMIT):
+
+    '''
+    Brings db.collection(username) up to date with the user's Liked Songs.
+
+    db (Client): Firestore client
+    sp (Spotify): spotipy client
+    username (string): user collection name
+    to_songs (function): turns a page of saved-tracks items into the song_data dicts that get stored
+    limit (int): how many of the newest songs a first import pulls in (None = the whole library)
+
+    Returns a summary dict: mode ('full' or 'incremental'), added, removed, requests, and the library version
+    (state_version) it's now at.
+    '''
+
+    state = load_state(db, username)
+
+    #1. FIRST RUN (OR A COLLECTION FROM BEFORE SYNC STATE EXISTED, OR AN INTERRUPTED IMPORT): FULL IMPORT
+    if state is None or 'latestAddedAt' not in state:
+        checkpoint = state if state and 'importOffset' in state else None
+        if checkpoint:
+            legacy = checkpoint['importLegacy']
+            print(f"Resuming import for '{username}' at song {checkpoint['importOffset']}")
+        else:
+            legacy = collection_exists(db, username)
+        stats, latest_added_at, total, imported_ids, requests_made = full_import(db, sp, username, to_songs, limit,
+                                                                                 checkpoint, legacy)
+        print(f"Imported {stats['songs']} songs in {stats['commits']} commits "
+              f"({stats['elapsed']:.2f}s, {stats['songs_per_sec']:.0f} songs/s, {stats['commit_seconds']:.2f}s committing)")
+
+        # Older imports used random document ids; anything not just rewritten is a stale duplicate
+        # (after a resume the ids written earlier aren't known, so reconcile re-reads the library for them).
+        # A resumed import also reconciles: songs unliked during the interruption may already have been written
+        removed = 0
+        if legacy or checkpoint:
+            removed, reconcile_requests = reconcile(db, sp, username, keep_ids=imported_ids)
+            requests_made += reconcile_requests
+
+        # Songs liked during the interruption sit above everything a resume imports and aren't stored; count only
+        # what's covered, so the next sync picks them up incrementally instead of reconciling the whole library
+        if checkpoint:
+            new_items, library_total, new_requests = fetch_new_items(sp, latest_added_at)
+            total = library_total - len(new_items)
+            requests_made += new_requests
+
+        save_state(db, username, latest_added_at, total)
+        invalidate_song_index(username)
+        return {'mode': 'full', 'added': stats['songs'], 'removed': removed, 'requests': requests_made,
+                'version': state_version({'latestAddedAt': latest_added_at, 'trackCount': total})}
+
+    #2. RETURNING USER: ONLY SONGS LIKED SINCE THE HIGH-WATER MARK
+    new_items, total, requests_made = fetch_new_items(sp, state['latestAddedAt'])
+    if new_items:
+        write_songs_batched(db, username, to_songs(new_items))
+
+    #3. CHEAP REMOVAL CHECK: LIBRARY SHOULD HAVE GROWN BY EXACTLY WHAT WE ADDED
+    removed = 0
+    if total != state['trackCount'] + len(new_items):
+        # The snapshot from the last sync (if still current) already lists what's stored; new songs are liked anyway
+        removed, reconcile_requests = reconcile(db, sp, username,
+                                                stored_ids=snapshot.doc_ids(username, state_version(state)))
+        requests_made += reconcile_requests
+
+    latest_added_at = max([state['latestAddedAt']] + [item['added_at'] for item in new_items])
+    save_state(db, username, latest_added_at, total)
+    if new_items or removed:
+        invalidate_song_index(username)
+    print(f"Synced '{username}': {len(new_items)} new, {removed} removed, {requests_made} Spotify requests")
+    return {'mode': 'incremental', 'added': len(new_items), 'removed': removed, 'requests': requests_made,
+            'version': state_version({'latestAddedAt': latest_added_at, 'trackCount': total})}
@@ -0,0 +1,76 @@
+'''
+Event cache sync modes: a full sync the first time, syncToken deltas after that, even on later days.
+
+Run with `python -m unittest discover tests` from the repo root.
+'''
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import event_cache
+
+DAY = 24 * 60 * 60
+LIBRARY_START = 1_600_000_000
+EVENT = {'id': 'e1', 'summary': 'Dentist',
+         'start': {'dateTime': '2021-01-01T10:00:00Z'}, 'end': {'dateTime': '2021-01-01T11:00:00Z'}}
+
+
+class FakeRequest:
+
+    def __init__(self, service, params):
+        self.service = service
+        self.params = params
+
+    def execute(self):
+        self.service.requests.append(self.params)
+        if 'syncToken' in self.params:
+            return {'items': [], 'nextSyncToken': 'token-delta'}
+        return {'items': [EVENT], 'nextSyncToken': 'token-full'}
+
+
+class FakeService:
+
+    def __init__(self):
+        self.requests = []
+
+    def events(self):
+        return self
+
+    def list(self, **params):
+        return FakeRequest(self, params)
+
+
+class SyncEventsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.original_dir = event_cache.CACHE_DIR
+        event_cache.CACHE_DIR = self.cache_dir.name
+        self.service = FakeService()
+
+    def tearDown(self):
+        event_cache.CACHE_DIR = self.original_dir
+        self.cache_dir.cleanup()
+
+    def sync(self, now, span_start=LIBRARY_START):
+        return event_cache.sync_events(self.service, 'user', 'UTC', span_start, now + DAY)
+
+    def test_second_day_run_is_incremental(self):
+        today = LIBRARY_START + 400 * DAY
+        self.assertEqual(self.sync(today), ('full', 1))
+        self.assertEqual(self.sync(today + DAY), ('incremental', 0))
+        self.assertEqual(self.sync(today + 30 * DAY)[0], 'incremental')
+        self.assertEqual(event_cache.cached_span('user'), (LIBRARY_START, today + 31 * DAY))
+        self.assertEqual(event_cache.event_starts('user'), [1609495200])
+
+    def test_older_library_start_forces_full_sync(self):
+        today = LIBRARY_START + 400 * DAY
+        self.sync(today)
+        self.assertEqual(self.sync(today + DAY, span_start=LIBRARY_START - DAY)[0], 'full')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+'''
+Rate limiter: calls are spaced to the configured rate, a throttled call waits out the upstream's Retry-After,
+and retries give up after MAX_RETRIES. Runs on a fake clock, so nothing actually sleeps.
+
+Run with `python -m unittest discover tests` from the repo root.
+'''
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import rate_limit
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 1e-9)  # like a real sleep, always some time passes (float rounding can't stall it)
+
+
+class Throttled(Exception):
+
+    def __init__(self, retry_after=None):
+        super().__init__('429 Too Many Requests')
+        self.http_status = 429
+        self.headers = {} if retry_after is None else {'Retry-After': str(retry_after)}
+
+
+class RateLimitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patches = [mock.patch.object(rate_limit, 'time', self.clock),
+                   mock.patch.object(rate_limit.random, 'uniform', lambda low, high: low)]  # no jitter
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.bucket = rate_limit.Bucket('test', 10.0, 1)
+        patch = mock.patch.dict(rate_limit.buckets, {'test': self.bucket})
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_calls_are_spaced_to_the_rate(self):
+        started = []
+        for _ in range(5):
+            rate_limit.call('test', 'ping', lambda: started.append(self.clock.now))
+        for i, at in enumerate(started):
+            self.assertAlmostEqual(at - started[0], i * 0.1)
+
+    def test_throttled_call_waits_for_retry_after(self):
+        started = []
+
+        def ping():
+            started.append(self.clock.now)
+            if len(started) == 1:
+                raise Throttled(retry_after=3)
+            return 'pong'
+
+        self.assertEqual(rate_limit.call('test', 'ping', ping), 'pong')
+        self.assertAlmostEqual(started[1] - started[0], 3.0 + 1 / 5.0)  # Retry-After, then a token at the halved rate
+        self.assertAlmostEqual(self.bucket.rate, 5.0 + 10.0 * rate_limit.RECOVERY_FRACTION)  # halved, then one success
+        self.assertEqual(self.bucket.throttles, 1)
+
+    def test_retries_stop_after_max_retries(self):
+        attempts = []
+
+        def ping():
+            attempts.append(self.clock.now)
+            raise Throttled()
+
+        with self.assertRaises(Throttled):
+            rate_limit.call('test', 'ping', ping)
+        self.assertEqual(len(attempts), rate_limit.MAX_RETRIES + 1)
+
+    def test_deadline_stops_retrying_early(self):
+        attempts = []
+
+        def ping():
+            attempts.append(self.clock.now)
+            raise Throttled(retry_after=30)
+
+        with self.assertRaises(Throttled):
+            rate_limit.call('test', 'ping', ping, deadline=self.clock.now + 10)
+        self.assertEqual(len(attempts), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+'''
+Library sync: an interrupted first import resumes from its cursor without skipping songs, and songs unliked
+since the last sync are reconciled away.
+
+Run with `python -m unittest discover tests` from the repo root.
+'''
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import ingest
+import snapshot
+import sync
+
+LIBRARY_SIZE = 1200  # three commits of ingest.BATCH_SIZE
+
+
+def saved_item(i, day=1):
+    return {'added_at': f'2020-01-{day:02d}T{i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d}Z',
+            'track': {'uri': f'spotify:track:{i:022d}'}}
+
+
+def to_songs(items):
+    return [{'addedDate': item['added_at'], 'trackURI': item['track']['uri']} for item in items]
+
+
+class FakeSpotify:
+
+    def __init__(self, items):
+        self.items = items  # newest first, like Liked Songs
+        self.requests = 0
+
+    def current_user_saved_tracks(self, limit=50, offset=0):
+        self.requests += 1
+        return {'items': self.items[offset:offset + limit], 'total': len(self.items)}
+
+
+class FakeDocument:
+
+    def __init__(self, db, collection_name, doc_id):
+        self.db = db
+        self.collection_name = collection_name
+        self.id = doc_id
+
+    def get(self):
+        data = self.db.data.get(self.collection_name, {}).get(self.id)
+        return FakeSnapshot(data)
+
+    def set(self, data):
+        self.db.data.setdefault(self.collection_name, {})[self.id] = dict(data)
+
+
+class FakeSnapshot:
+
+    def __init__(self, data):
+        self.exists = data is not None
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class FakeCollection:
+
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def document(self, doc_id):
+        return FakeDocument(self.db, self.name, doc_id)
+
+    def list_documents(self):
+        return [self.document(doc_id) for doc_id in list(self.db.data.get(self.name, {}))]
+
+    def limit(self, count):
+        return self
+
+    def get(self):
+        return self.list_documents()[:1]
+
+
+class FakeBatch:
+
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, document, data):
+        self.writes.append((document, data))
+
+    def delete(self, document):
+        self.writes.append((document, None))
+
+    def commit(self):
+        if self.db.fail_at_commit == self.db.commits:
+            raise RuntimeError('connection reset')
+        self.db.commits += 1
+        for document, data in self.writes:
+            if data is None:
+                self.db.data.get(document.collection_name, {}).pop(document.id, None)
+            else:
+                document.set(data)
+
+
+class FakeFirestore:
+
+    def __init__(self):
+        self.data = {}  # collection name -> {doc id: dict}
+        self.commits = 0
+        self.fail_at_commit = None
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def stored_ids(self, username):
+        return set(self.data.get(username, {}))
+
+
+def doc_ids(items):
+    return {ingest.song_doc_id(item['track']['uri']) for item in items}
+
+
+class SyncLibraryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.snapshot_dir = tempfile.TemporaryDirectory()
+        self.original_dir = snapshot.SNAPSHOT_DIR
+        snapshot.SNAPSHOT_DIR = self.snapshot_dir.name
+        self.db = FakeFirestore()
+        self.sp = FakeSpotify([saved_item(i) for i in reversed(range(LIBRARY_SIZE))])
+
+    def tearDown(self):
+        snapshot.SNAPSHOT_DIR = self.original_dir
+        self.snapshot_dir.cleanup()
+
+    def sync(self):
+        return sync.sync_library(self.db, self.sp, 'user', to_songs, limit=None)
+
+    def test_resume_after_interruption_skips_nothing(self):
+        #1. FIRST IMPORT DIES AFTER ONE COMMIT
+        self.db.fail_at_commit = 1
+        with self.assertRaises(RuntimeError):
+            self.sync()
+        checkpoint = sync.load_state(self.db, 'user')
+        self.assertEqual(checkpoint['importOffset'], ingest.BATCH_SIZE)
+        self.assertEqual(checkpoint['importCursor'], self.sp.items[ingest.BATCH_SIZE - 1]['added_at'])
+
+        #2. MEANWHILE: 100 ALREADY-IMPORTED SONGS UNLIKED (SHIFTING EVERY OFFSET), 3 NEW ONES LIKED
+        unliked = self.sp.items[100:200]
+        liked = [saved_item(i, day=2) for i in reversed(range(3))]
+        self.sp.items = liked + self.sp.items[:100] + self.sp.items[200:]
+
+        #3. RESUME: EVERY OLDER SONG STORED, UNLIKED ONES RECONCILED AWAY, NEW LIKES LEFT FOR THE NEXT SYNC
+        self.db.fail_at_commit = None
+        summary = self.sync()
+        self.assertEqual(summary['mode'], 'full')
+        self.assertEqual(summary['removed'], len(unliked))
+        self.assertEqual(self.db.stored_ids('user'), doc_ids(self.sp.items[len(liked):]))
+        self.assertNotIn('importOffset', sync.load_state(self.db, 'user'))
+
+        #4. NEXT SYNC: JUST THE NEW LIKES, NO WHOLE-LIBRARY RECONCILE
+        self.sp.requests = 0
+        summary = self.sync()
+        self.assertEqual((summary['mode'], summary['added'], summary['removed']), ('incremental', len(liked), 0))
+        self.assertEqual(self.sp.requests, 1)
+        self.assertEqual(self.db.stored_ids('user'), doc_ids(self.sp.items))
+
+    def test_reconcile_removes_unliked_songs(self):
+        self.sync()
+        self.assertEqual(self.db.stored_ids('user'), doc_ids(self.sp.items))
+
+        unliked = self.sp.items[10:15]
+        self.sp.items = self.sp.items[:10] + self.sp.items[15:]
+        summary = self.sync()
+        self.assertEqual((summary['mode'], summary['added'], summary['removed']), ('incremental', 0, len(unliked)))
+        self.assertEqual(self.db.stored_ids('user'), doc_ids(self.sp.items))
+
+
+if __name__ == '__main__':
+    unittest.main()
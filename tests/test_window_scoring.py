@@ -0,0 +1,50 @@
+'''
+Window sampling: drawn windows never share a song, and windows with no weight are never drawn.
+
+Run with `python -m unittest discover tests` from the repo root.
+'''
+
+import os
+import random
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import window_scoring
+
+PLAYLIST_LENGTH = 20
+
+
+class SampleWindowsTest(unittest.TestCase):
+
+    def test_windows_do_not_overlap(self):
+        rng = random.Random(7)
+        for seed in range(50):
+            weights = np.random.default_rng(seed).random(500)
+            picked = window_scoring.sample_windows(weights, 10, PLAYLIST_LENGTH, rng=rng)
+            self.assertEqual(len(picked), 10)
+            firsts = sorted(picked)
+            for previous, first in zip(firsts, firsts[1:]):
+                self.assertGreaterEqual(first - previous, PLAYLIST_LENGTH)
+
+    def test_stops_when_no_weight_is_left(self):
+        weights = np.zeros(100)
+        weights[[10, 15, 60]] = 1.0  # 10 and 15 share songs, so only one of them can be drawn
+        picked = window_scoring.sample_windows(weights, 10, PLAYLIST_LENGTH, rng=random.Random(1))
+        self.assertEqual(len(picked), 2)
+        self.assertIn(60, picked)
+        self.assertTrue(set(picked) - {60} <= {10, 15})
+
+    def test_scored_windows_sample_without_overlap(self):
+        epochs = np.cumsum(np.random.default_rng(3).integers(60, 7 * 24 * 3600, 2000)).astype(np.int64)
+        event_starts = epochs[::37] + 60
+        weights, _ = window_scoring.score_windows(epochs, event_starts, PLAYLIST_LENGTH, now=int(epochs[-1]))
+        self.assertEqual(len(weights), len(epochs) - PLAYLIST_LENGTH + 1)
+        picked = sorted(window_scoring.sample_windows(weights, 10, PLAYLIST_LENGTH, rng=random.Random(5)))
+        self.assertTrue(all(b - a >= PLAYLIST_LENGTH for a, b in zip(picked, picked[1:])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,24 +1,106 @@
-import pytz
-from datetime import datetime
-
-# Current UTC time
-utc_now = datetime.utcnow()
-
-# Initialize an empty dictionary
-timezone_dict = {}
-
-# Populate the dictionary with timezone names and their UTC offsets in ±HH:MM format
-for timezone_str in pytz.all_timezones:
-    timezone = pytz.timezone(timezone_str)
-    offset = timezone.utcoffset(utc_now)
-    offset_hours = int(offset.total_seconds() // 3600)
-    offset_minutes = int((offset.total_seconds() % 3600) // 60)
-
-    # Format offset as ±HH:MM
-    formatted_offset = f"{offset_hours:+03d}:{abs(offset_minutes):02d}"
-
-    # Replace underscores with spaces in timezone names
-    formatted_timezone_str = timezone_str
-    
-    # Add to dictionary
-    timezone_dict[formatted_timezone_str] = formatted_offset
+'''
+Timezone helpers for turning Spotify's UTC added_at timestamps into local times on the user's calendar.
+
+Offsets are resolved lazily with zoneinfo and memoized, and always for the instant being converted, so a song
+liked in July gets the summer offset and one liked in January the winter offset (a single "today" offset
+put half the library an hour off across DST). Nothing is computed at import time.
+'''
+
+from datetime import datetime, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+SPOTIFY_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+BUCKET_SECONDS = 15 * 60  # every modern UTC offset change lands on a quarter hour
+
+
+@lru_cache(maxsize=None)
+def get_zone(timezone_name):
+
+    '''
+    ZoneInfo for a Google Calendar timezone label (e.g. "America/New_York"), loaded once per name.
+    '''
+
+    try:
+        return ZoneInfo(timezone_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Timezone not found: {timezone_name}")
+
+
+@lru_cache(maxsize=65536)
+def offset_for_bucket(timezone_name, bucket):
+
+    '''
+    UTC offset (timedelta) in effect in timezone_name during the quarter-hour bucket starting at bucket * BUCKET_SECONDS.
+    '''
+
+    instant = datetime.fromtimestamp(bucket * BUCKET_SECONDS, timezone.utc)
+    return instant.astimezone(get_zone(timezone_name)).utcoffset()
+
+
+def utc_offset(timezone_name, epoch):
+    return offset_for_bucket(timezone_name, int(epoch) // BUCKET_SECONDS)
+
+
+def format_offset(offset):
+
+    '''
+    timedelta -> "±HH:MM"
+    '''
+
+    minutes = int(offset.total_seconds() // 60)
+    sign = '-' if minutes < 0 else '+'
+    return f"{sign}{abs(minutes) // 60:02d}:{abs(minutes) % 60:02d}"
+
+
+def spotify_epoch(date):
+
+    '''
+    UTC epoch seconds for a Spotify added_at string ("2022-09-14T00:11:26Z").
+    '''
+
+    return int(datetime.strptime(date, SPOTIFY_DATE_FORMAT).replace(tzinfo=timezone.utc).timestamp())
+
+
+def local_date_string(epoch, timezone_name):
+
+    '''
+    Local wall-clock time plus the offset in effect at that instant: "2022-09-13T20:11:26-04:00".
+    '''
+
+    offset = utc_offset(timezone_name, epoch)
+    local_dt = datetime.fromtimestamp(epoch, timezone.utc) + offset
+    return local_dt.strftime("%Y-%m-%dT%H:%M:%S") + format_offset(offset)
+
+
+def spotify_to_local(date, timezone_name):
+    return local_date_string(spotify_epoch(date), timezone_name)
+
+
+def convert_page(dates, timezone_name):
+
+    '''
+    Bulk version of spotify_to_local for a whole saved-tracks page of added_at strings.
+
+    The page is grouped by quarter-hour bucket first: each distinct bucket's offset is looked up (and formatted) once,
+    then applied to every date in it. A page usually spans a handful of offsets at most, so that's a few lookups
+    instead of one per song. Returns (epochs, local date strings), both in input order.
+    '''
+
+    get_zone(timezone_name)  # fail fast on an unknown zone, before touching any dates
+    epochs = [spotify_epoch(date) for date in dates]
+
+    #1. ONE OFFSET PER DISTINCT BUCKET IN THE PAGE
+    buckets = [epoch // BUCKET_SECONDS for epoch in epochs]
+    offsets = {}
+    for bucket in set(buckets):
+        offset = offset_for_bucket(timezone_name, bucket)
+        offsets[bucket] = (offset, format_offset(offset))
+
+    #2. APPLY EACH DATE'S BUCKET OFFSET
+    local_dates = []
+    for epoch, bucket in zip(epochs, buckets):
+        offset, suffix = offsets[bucket]
+        local_dt = datetime.fromtimestamp(epoch, timezone.utc) + offset
+        local_dates.append(local_dt.strftime("%Y-%m-%dT%H:%M:%S") + suffix)
+    return epochs, local_dates
@@ -1,55 +1,162 @@
 '''
-The sole purpose of this script is to catch the need to re-login to Google when user clicks "Make Another".
+The sole purpose of this module is to catch the need to re-login to Google or Spotify when user clicks "Make Another".
 Having these quick error-handling things here is faster than running all of logic.py just for there to be an error
-in the first few lines. 
+in the first few lines.
+
+It runs in-process (it used to be a separate `python token_check.py` interpreter whose exit code main.py read) and
+remembers its verdicts per session for a short while: token expiry is checked locally first, the liked-songs count
+is only re-checked every SONG_COUNT_TTL, and Google credentials are trusted until they expire. So the usual click
+costs no network calls at all.
 '''
 
+import calendar
+import threading
+import time
+
+from google.auth.exceptions import TransportError
+from requests.exceptions import RequestException
+from spotipy.exceptions import SpotifyException
+from spotipy.oauth2 import SpotifyOauthError
+
+import clients
+import metrics
+import rate_limit
+
+# RESULT CODES (same numbers the old script exited with)
+OK = 0
+GOOGLE_LOGIN = 1
+SPOTIFY_LOGIN = 2
+TOO_FEW_SONGS = 3
+UNAVAILABLE = 4  # couldn't reach Spotify or Google; nothing wrong with the login, so never remembered
+
+MESSAGES = {
+    GOOGLE_LOGIN: "Log into Google again, and this should work just fine.",
+    SPOTIFY_LOGIN: "Log into Spotify again, then try this one more time.",
+    UNAVAILABLE: "Couldn't reach Spotify or Google just now. Give it a few seconds and try again.",
+    TOO_FEW_SONGS: "This works best if you have more than 50 songs on your Spotify Liked Songs playlist. Take some time to discover new music, then come back here when the time is right."
+}
+
+MIN_LIKED_SONGS = 50
+SONG_COUNT_TTL = 10 * 60      # re-check the liked-songs count at most this often
+GOOGLE_VERDICT_TTL = 10 * 60  # how long to trust Google creds whose expiry we don't know
+
+verdicts = {}  # session_id -> {'enough_songs_until': t, 'google_valid_until': t}
+verdicts_lock = threading.Lock()
+
+
+def result(code):
+    return {'ok': code == OK, 'code': code, 'message': MESSAGES.get(code)}
 
-import os
-import spotipy
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-import json
 
-def load_google_credentials(creds_file):
-    with open(creds_file, 'r') as infile:
-        creds_data = json.load(infile)
-        return Credentials(**creds_data)
-    
+def get_verdicts(session_id):
+    with verdicts_lock:
+        return dict(verdicts.get(session_id, {}))
 
-def main():
-    print('RUNNING token_checker.PY')
 
-    # CHECK FOR SPOTIFY API CALL ACCESS
-    token = os.getenv('SPOTIFY_ACCESS_TOKEN')
-    if not token:
+def remember(session_id, **fields):
+    with verdicts_lock:
+        verdicts.setdefault(session_id, {}).update(fields)
+
+
+def forget(session_id):
+
+    '''
+    Drops a session's cached verdicts (on login/logout, when the answers may have changed).
+    '''
+
+    with verdicts_lock:
+        verdicts.pop(session_id, None)
+
+
+def check_spotify(session_id, token_info, now):
+
+    #1. LOCAL CHECKS FIRST: NO TOKEN, OR AN EXPIRED ONE WE CAN'T REFRESH
+    if not token_info or not token_info.get('access_token'):
         print("Spotify access token is missing.")
-        exit(2)
-    
-    # LOCAL SPOTIFY SETUP
-    sp = spotipy.Spotify(auth=token)
-    username = sp.current_user()['display_name'] #get username
-
-    # Check number of liked songs
-    results = sp.current_user_saved_tracks(limit=1)  # Get just the total count
-    total_liked_songs = results['total']
-    if total_liked_songs < 50:
-        print(f"User {username} has less than 50 liked songs.")
-        exit(3)
-   
-    # LOCAL GCAL SETUP
-    service = None
-    creds_file = os.getenv('GOOGLE_CREDENTIALS_FILE')
-    google_calendar_timezone = os.getenv('GOOGLE_CALENDAR_TIMEZONE')
-    if creds_file and google_calendar_timezone:
-        try:
-            creds = load_google_credentials(creds_file)
-            service = build('calendar', 'v3', credentials=creds)
-        except Exception as e:
-            print(f"Error setting up Google Calendar service: {e}")
-    if service is None:
-        print("Error: Google Calendar service setup failed.")
-        exit(1)
-
-if __name__ == '__main__':
-    main()
+        return SPOTIFY_LOGIN
+    if token_info.get('expires_at', now + 1) <= now and not token_info.get('refresh_token'):
+        return SPOTIFY_LOGIN
+
+    #2. CACHED "ENOUGH LIKED SONGS" VERDICT
+    if get_verdicts(session_id).get('enough_songs_until', 0) > now:
+        return OK
+
+    #3. ONLY THEN ASK SPOTIFY (ONE CALL, JUST THE TOTAL)
+    try:
+        sp = clients.get_spotify(session_id, token_info)
+        total_liked_songs = rate_limit.call('spotify', 'current_user_saved_tracks', sp.current_user_saved_tracks,
+                                            limit=1)['total']
+    except SpotifyException as e:
+        if metrics.is_throttled(e):  # still throttled after the rate limiter's retries
+            print(f"Spotify preflight throttled: {e}")
+            return UNAVAILABLE
+        print(f"Spotify preflight failed: {e}")
+        return SPOTIFY_LOGIN
+    except SpotifyOauthError as e:  # the refresh token was revoked
+        print(f"Spotify preflight failed: {e}")
+        return SPOTIFY_LOGIN
+    except RequestException as e:
+        print(f"Spotify preflight couldn't reach Spotify: {e}")
+        return UNAVAILABLE
+
+    if total_liked_songs < MIN_LIKED_SONGS:
+        print(f"Session {session_id} has less than {MIN_LIKED_SONGS} liked songs.")
+        return TOO_FEW_SONGS
+
+    remember(session_id, enough_songs_until=now + SONG_COUNT_TTL)
+    return OK
+
+
+def check_google(session_id, google_credentials, calendar_timezone, now):
+
+    #1. LOCAL CHECKS FIRST
+    if not google_credentials or not calendar_timezone:
+        return GOOGLE_LOGIN
+    if not google_credentials.get('token') and not google_credentials.get('refresh_token'):
+        return GOOGLE_LOGIN
+
+    #2. CACHED "CREDS VALID UNTIL T" VERDICT
+    if get_verdicts(session_id).get('google_valid_until', 0) > now:
+        return OK
+
+    #3. SET UP (OR REUSE) THE CALENDAR SERVICE, REFRESHING THE CREDENTIALS IF THEY'VE EXPIRED
+    try:
+        clients.get_calendar(session_id, google_credentials)
+        creds = clients.get_google_credentials(session_id)
+    except (TransportError, RequestException) as e:  # a dropped connection during the refresh isn't a bad login
+        print(f"Google preflight couldn't reach Google: {e}")
+        return UNAVAILABLE
+    except Exception as e:
+        print(f"Error setting up Google Calendar service: {e}")
+        return GOOGLE_LOGIN
+
+    if creds is not None and creds.expiry is not None:
+        # google-auth keeps expiry as a naive UTC datetime
+        valid_until = calendar.timegm(creds.expiry.utctimetuple()) - clients.EXPIRY_MARGIN
+    else:
+        valid_until = now + GOOGLE_VERDICT_TTL
+    remember(session_id, google_valid_until=valid_until)
+    return OK
+
+
+def check(session_id, token_info, google_credentials, calendar_timezone):
+
+    '''
+    Preflight for a playlist job. Returns {'ok', 'code', 'message'}; message is what the frontend shows on failure.
+
+    session_id (string): session uuid
+    token_info (dict): Spotify token_info from the Flask session
+    google_credentials (dict): Google credentials from the Flask session
+    calendar_timezone (string): the user's primary calendar timezone
+    '''
+
+    now = time.time()
+
+    code = check_spotify(session_id, token_info, now)
+    if code == OK:
+        code = check_google(session_id, google_credentials, calendar_timezone, now)
+
+    # A failed check drops whatever was remembered, unless it only failed to reach the upstream
+    if code not in (OK, UNAVAILABLE):
+        forget(session_id)
+    return result(code)
@@ -0,0 +1,124 @@
+'''
+Per-session store for OAuth state: the Spotify token_info, the Google credentials dict and the calendar timezone.
+
+This replaces the process-global SPOTIFY_ACCESS_TOKEN / GOOGLE_CALENDAR_TIMEZONE environment variables and the
+single shared google_creds.json, where every login overwrote the previous user's tokens. Jobs get a session id
+and read that session's tokens from here, so any number of users can generate playlists at once.
+
+Entries live in memory. Setting TOKEN_STORE_DB (a SQLite path) or TOKEN_STORE_REDIS_URL (any Redis-compatible
+server, needs the `redis` package) also writes them through to a persistent backend, so sessions survive a restart
+and can be shared between app processes.
+'''
+
+import json
+import os
+import sqlite3
+import threading
+
+DB_PATH = os.getenv('TOKEN_STORE_DB')
+REDIS_URL = os.getenv('TOKEN_STORE_REDIS_URL')
+REDIS_PREFIX = 'capsule:tokens:'
+
+FIELDS = ('spotify_token_info', 'google_credentials', 'calendar_timezone')
+
+entries = {}  # session_id -> {field: value}
+entries_lock = threading.Lock()
+redis_client = None
+
+
+# PERSISTENT BACKENDS (BOTH OPTIONAL)
+def connect():
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute('CREATE TABLE IF NOT EXISTS tokens (session_id TEXT PRIMARY KEY, data TEXT NOT NULL)')
+    return conn
+
+
+def get_redis():
+    global redis_client
+    if redis_client is None:
+        import redis
+        redis_client = redis.Redis.from_url(REDIS_URL)
+    return redis_client
+
+
+def load_persisted(session_id):
+    if REDIS_URL:
+        data = get_redis().get(REDIS_PREFIX + session_id)
+        return json.loads(data) if data else None
+    if DB_PATH:
+        conn = connect()
+        try:
+            row = conn.execute('SELECT data FROM tokens WHERE session_id = ?', (session_id,)).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else None
+    return None
+
+
+def persist(session_id, entry):
+    if REDIS_URL:
+        get_redis().set(REDIS_PREFIX + session_id, json.dumps(entry))
+    elif DB_PATH:
+        conn = connect()
+        try:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO tokens (session_id, data) VALUES (?, ?)', (session_id, json.dumps(entry)))
+        finally:
+            conn.close()
+
+
+def unpersist(session_id):
+    if REDIS_URL:
+        get_redis().delete(REDIS_PREFIX + session_id)
+    elif DB_PATH:
+        conn = connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM tokens WHERE session_id = ?', (session_id,))
+        finally:
+            conn.close()
+
+
+# STORE API
+def get(session_id):
+
+    '''
+    A copy of the session's token state ({'spotify_token_info', 'google_credentials', 'calendar_timezone'}),
+    or None if the session has never logged in.
+    '''
+
+    with entries_lock:
+        entry = entries.get(session_id)
+        if entry is not None:
+            return dict(entry)
+
+    entry = load_persisted(session_id)
+    if entry is None:
+        return None
+    with entries_lock:
+        entries.setdefault(session_id, entry)
+    return dict(entry)
+
+
+def update(session_id, **fields):
+
+    '''
+    Sets some of the session's fields (the rest are kept), e.g. update(uuid, spotify_token_info=token_info).
+    '''
+
+    unknown = set(fields) - set(FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown token store fields: {', '.join(sorted(unknown))}")
+
+    current = get(session_id) or {}
+    with entries_lock:
+        entry = entries.setdefault(session_id, current)
+        entry.update(fields)
+        snapshot = dict(entry)
+    persist(session_id, snapshot)
+
+
+def delete(session_id):
+    with entries_lock:
+        entries.pop(session_id, None)
+    unpersist(session_id)
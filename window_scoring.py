@@ -0,0 +1,90 @@
+'''
+Scores every possible capsule window at once and samples the ones worth turning into playlists.
+
+A window is playlist_length consecutive songs in the user's liked-songs timeline. Each one gets a weight from:
+- span: how tightly the songs cluster in time (a 20-song window stretched over months makes a poor capsule)
+- event density: calendar events per day inside the window (from the local event cache)
+- recency: how long ago it was (the last few months are what the user already listens to)
+
+All windows are scored in one vectorized NumPy pass over the epoch column, read in place from the song index
+(array or mmap'd snapshot, no copy), and sampling is a weighted draw over the result. So picking candidates takes
+microseconds to milliseconds even for a 100k-song library, instead of random dates plus trial lookups.
+'''
+
+import random
+import time
+
+import numpy as np
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+SPAN_SCALE_DAYS = 30.0       # a window spanning this many days keeps ~37% of its weight
+MIN_SPAN_DAYS = 1.0          # density floor, so a burst liked within an hour doesn't score as infinitely dense
+RECENCY_SCALE_DAYS = 90.0    # windows ending this recently keep ~63% of their weight
+
+
+def score_windows(epochs, event_starts, playlist_length, now=None):
+
+    '''
+    Weight and event count for every window of playlist_length consecutive songs.
+
+    epochs (sequence): sorted UTC epoch seconds of the user's songs (song index 'epochs': array or memoryview of int64)
+    event_starts (sequence): sorted UTC epoch start times of the user's calendar events (may be empty)
+    playlist_length (int): songs per window
+    now (int): UTC epoch seconds recency is measured from (default: current time)
+
+    Returns (weights, events): float64 and int64 arrays, one entry per window, indexed by the window's first song.
+    If no window has any events (empty calendar), weights fall back to span and recency alone.
+    '''
+
+    epochs = np.frombuffer(epochs, dtype=np.int64) if not isinstance(epochs, np.ndarray) else epochs
+    window_count = len(epochs) - playlist_length + 1
+    if window_count <= 0:
+        return np.zeros(0), np.zeros(0, dtype=np.int64)
+
+    starts = np.asarray(event_starts, dtype=np.int64)
+    now = time.time() if now is None else now
+
+    #1. BOOKENDS OF EVERY WINDOW, AS TWO SHIFTED VIEWS OF THE SAME COLUMN
+    first = epochs[:window_count]
+    last = epochs[playlist_length - 1:]
+    span_days = (last - first) / SECONDS_PER_DAY
+
+    #2. EVENTS STARTING IN [FIRST SONG, LAST SONG), TWO BINARY SEARCHES FOR ALL WINDOWS AT ONCE
+    events = np.searchsorted(starts, last, side='left') - np.searchsorted(starts, first, side='left')
+
+    #3. COMBINE: DENSE, TIGHT, NOT-TOO-RECENT WINDOWS WIN
+    span_term = np.exp(-span_days / SPAN_SCALE_DAYS)
+    age_days = np.maximum(now - last, 0) / SECONDS_PER_DAY
+    recency_term = -np.expm1(-age_days / RECENCY_SCALE_DAYS)
+    density_term = np.log1p(events / np.maximum(span_days, MIN_SPAN_DAYS))
+
+    weights = density_term * span_term * recency_term
+    if not weights.any():
+        weights = span_term * recency_term
+    if not weights.any():
+        weights = np.ones(window_count)
+    return weights, events
+
+
+def sample_windows(weights, count, playlist_length, rng=random):
+
+    '''
+    Draws up to count non-overlapping windows, each with probability proportional to its weight.
+
+    Returns the windows' first-song indices in the order they were drawn (the first is a plain weighted draw).
+    '''
+
+    weights = np.array(weights, dtype=np.float64)
+    picked = []
+    while len(picked) < count:
+        cumulative = np.cumsum(weights)
+        total = cumulative[-1] if len(cumulative) else 0.0
+        if total <= 0:
+            break
+        first = min(int(np.searchsorted(cumulative, rng.random() * total, side='right')), len(weights) - 1)
+        picked.append(first)
+
+        # Nothing that shares a song with this window can be drawn again
+        weights[max(0, first - playlist_length + 1):first + playlist_length] = 0.0
+    return picked